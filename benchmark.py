@@ -0,0 +1,516 @@
+'''
+Offline benchmark for main.py
+
+Generates synthetic FAOSTAT-shaped zip/csv files and World Bank-shaped JSON at a configurable scale
+(countries x indicators x years), serves them from a local HTTP server standing in for fenixservices.fao.org
+and api.worldbank.org, and uploads into a local database instead of the RDS SQL Server.
+Each stage is then timed separately: WorldBank, every FAO.sourceN, all FAO sources together,
+aggregate_and_upload_data, and every upload_table call, so regressions and speedups can be compared across runs.
+
+Example: python benchmark.py --countries 33 --indicators 50 --years 60 --repeat 3 --output bench.json
+
+By default uploads go to an in-memory sqlite database. To benchmark against a local SQL Server instead,
+pass its pyodbc connection string with --odbc.
+'''
+import argparse
+import json
+import os
+import random
+import re
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+import zipfile
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pandas as pd
+
+import main
+
+
+# How target countries are spelled by each source, synthetic countries are spelled the same everywhere
+WB_COUNTRY_NAMES = {'Venezuela': 'Venezuela, RB',
+                    'Bahamas': 'Bahamas, The'}
+FAO_COUNTRY_NAMES = {'Venezuela': 'Venezuela (Bolivarian Republic of)',
+                     'Bolivia': 'Bolivia (Plurinational State of)',
+                     'St. Kitts and Nevis': 'Saint Kitts and Nevis',
+                     'St. Lucia': 'Saint Lucia',
+                     'St. Vincent and the Grenadines': 'Saint Vincent and the Grenadines'}
+
+# Countries added in global mode, as (ISO3 code, World Bank name, FAO area code, FAO name). They are spelled
+# differently by each source like in the real files, and are only matched through the ISO3 codes of FAO's area list
+GLOBAL_COUNTRIES = [('USA', 'United States', 231, 'United States of America'),
+                    ('GBR', 'United Kingdom', 229, 'United Kingdom of Great Britain and Northern Ireland'),
+                    ('CHN', 'China', 41, 'China, mainland'),
+                    ('HKG', 'Hong Kong SAR, China', 96, 'China, Hong Kong SAR')]
+
+# FAO areas that aren't countries, as (area code, name, ISO3 code in FAO's area list): a regional aggregate,
+# and 351 China which is the sum of 41 China, mainland (the World Bank's China), Hong Kong, Macao and Taiwan
+AGGREGATE_AREA_CODE = 5000
+FAO_OTHER_AREAS = [(AGGREGATE_AREA_CODE, 'World', None), (351, 'China', 'CHN')]
+
+EMPLOYMENT_INDICATORS = ['Employment-to-population ratio, rural areas',
+                         'Employment-to-population ratio, rural areas, female']
+TRADE_ELEMENTS = [('Export Value', '1000 US$'), ('Import Value', '1000 US$'),
+                  ('Export Quantity', 'tonnes'), ('Import Quantity', 'tonnes')]
+
+
+def get_countries(n_countries):
+    '''
+    The first n_countries of the dashboard's countries, padded with synthetic countries if more are asked for
+    '''
+    countries = list(main.countries[:n_countries])
+    for i in range(len(countries), n_countries):
+        countries.append(f"Synthetic Country {i}")
+    return countries
+
+
+def get_country_codes(country, index):
+    '''
+    The ISO3 code and FAO area code of a country, made up for synthetic countries so they are only matched by name
+    '''
+    return main.COUNTRY_CODES.get(country, (f"S{index:02d}", 1000 + index))
+
+
+def write_area_list(areas, fixture_dir):
+    '''
+    Writes FAO's list of areas, areas is a list of (area code, name, ISO3 code)
+    '''
+    rows = [{"Country Code": area_code, "Country": area, "M49 Code": "", "ISO2 Code": "", "ISO3 Code": iso3,
+             "Start Year": "", "End Year": ""} for area_code, area, iso3 in areas]
+    pd.DataFrame(rows).to_csv(os.path.join(fixture_dir, "api", "area.csv"), index=False)
+
+
+def random_values(rng, n, missing=0.1):
+    # Values with some missing entries, like the real files
+    return [None if rng.random() < missing else round(rng.uniform(0, 1000), 3) for _ in range(n)]
+
+
+def write_zipped_csv(df, zip_path, csv_name):
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr(csv_name, df.to_csv(index=False))
+
+
+def write_bulk_file(df, fixture_dir, zip_prefix, csv_prefix, region, global_mode):
+    '''
+    Writes a bulk file the way FAOSTAT names them, or one file per region of FAO.regions in global mode.
+    Countries are spread over the regions, and aggregates (area codes from AGGREGATE_AREA_CODE up) are in every region
+    '''
+    if not global_mode:
+        write_zipped_csv(df, os.path.join(fixture_dir, "bulk", f"{zip_prefix}_{region}.zip"), f"{csv_prefix}_{region}_NOFLAG.csv")
+        return
+    regions = main.FAO.regions
+    for number, region in enumerate(regions):
+        region_df = df[(df["Area Code"] >= AGGREGATE_AREA_CODE) | (df["Area Code"] % len(regions) == number)]
+        write_zipped_csv(region_df, os.path.join(fixture_dir, "bulk", f"{zip_prefix}_{region}.zip"), f"{csv_prefix}_{region}_NOFLAG.csv")
+
+
+def generate_fixtures(fixture_dir, n_countries, n_indicators, n_years, seed=0, global_mode=False):
+    '''
+    Writes every file the sources download into fixture_dir:
+        bulk/ the FAOSTAT bulk zip files of sources 1, 2 and 5, split by region in global mode
+        api/ the FAOSTAT api csv responses of sources 3, 4 and 6, and FAO's list of areas
+        wb/ one json list of World Bank entries per indicator code, and the list of countries
+    n_indicators is the number of items in each bulk file, on top of the ones the sources keep.
+    In global mode the files also have the countries of GLOBAL_COUNTRIES, and rows for the areas of FAO_OTHER_AREAS,
+    which should be left out. Returns the list of countries in the files
+    '''
+    rng = random.Random(seed)
+    countries = get_countries(n_countries)
+    years = list(range(2021 - n_years, 2021))
+    fao_areas = [(get_country_codes(country, index)[1], FAO_COUNTRY_NAMES.get(country, country))
+                 for index, country in enumerate(countries)]
+    area_list = [(area_code, area, get_country_codes(country, index)[0])
+                 for index, (country, (area_code, area)) in enumerate(zip(countries, fao_areas))]
+    if global_mode:
+        # The other areas come first, so if one of them was kept the countries it overlaps would have its values
+        fao_areas += [(area_code, area) for area_code, area, _ in FAO_OTHER_AREAS]
+        fao_areas += [(area_code, area) for _, _, area_code, area in GLOBAL_COUNTRIES]
+        area_list += [(area_code, area, iso3) for iso3, _, area_code, area in GLOBAL_COUNTRIES] + FAO_OTHER_AREAS
+    for sub_dir in ("bulk", "api", "wb"):
+        os.makedirs(os.path.join(fixture_dir, sub_dir), exist_ok=True)
+    write_area_list(area_list, fixture_dir)
+
+    # Source 1: food security indicators, with both single year and 3-year interval columns
+    food_security_items = [indicator[len("FAO "):] for indicator in main.INDICATOR_CATEGORIES["FAO"]]
+    food_security_items += [f"Synthetic food security indicator {i}" for i in range(n_indicators)]
+    single_year_columns = [f"Y{year}" for year in years]
+    interval_columns = [f"Y{year - 2}{year}" for year in years]
+    rows = []
+    for area_code, area in fao_areas:
+        for item_code, item in enumerate(food_security_items, start=1):
+            row = {"Area Code": area_code, "Area": area, "Item Code": item_code, "Item": item,
+                   "Element Code": 6120, "Element": "Value", "Unit": "%"}
+            # Items are either yearly or 3-year averages, never both
+            if "3-year average" in item:
+                row.update(dict.fromkeys(single_year_columns))
+                row.update(zip(interval_columns, random_values(rng, len(interval_columns))))
+            else:
+                row.update(zip(single_year_columns, random_values(rng, len(single_year_columns))))
+                row.update(dict.fromkeys(interval_columns))
+            # Items we don't keep can have text values, like FAOSTAT's "<2.5" for undernourishment
+            if n_indicators and item_code == len(food_security_items):
+                row[single_year_columns[0]] = "<2.5"
+            rows.append(row)
+    write_bulk_file(pd.DataFrame(rows), fixture_dir, "Food_Security_Data_E", "Food_Security_Data_E",
+                    "Latin_America_and_the_Caribbean", global_mode)
+
+    # Source 2: trade of crops and livestock, summed across every item
+    year_columns = [f"Y{year}" for year in years]
+    rows = []
+    for area_code, area in fao_areas:
+        for item_code in range(1, n_indicators + 1):
+            for element_code, (element, unit) in enumerate(TRADE_ELEMENTS, start=1):
+                row = {"Area Code": area_code, "Area": area, "Item Code": item_code, "Item": f"Synthetic crop {item_code}",
+                       "Element Code": element_code, "Element": element, "Unit": unit}
+                row.update(zip(year_columns, random_values(rng, len(year_columns))))
+                rows.append(row)
+    write_bulk_file(pd.DataFrame(rows), fixture_dir, "Trade_CropsLivestock_E", "Trade_Crops_Livestock_E",
+                    "All_Data", global_mode)
+
+    # Source 5: employment indicators
+    rows = []
+    for area_code, area in fao_areas:
+        indicators = EMPLOYMENT_INDICATORS + [f"Synthetic employment indicator {i}" for i in range(n_indicators)]
+        for indicator_code, indicator in enumerate(indicators, start=1):
+            row = {"Area Code": area_code, "Area": area, "Source Code": 1, "Source": "Synthetic survey",
+                   "Indicator Code": indicator_code, "Indicator": indicator, "Unit": "%"}
+            row.update(zip(year_columns, random_values(rng, len(year_columns))))
+            rows.append(row)
+    write_bulk_file(pd.DataFrame(rows), fixture_dir, "Employment_Indicators_E", "Employment_Indicators_E",
+                    "All_Data", global_mode)
+
+    # Source 3: cereal import dependency ratio, one row per 3-year interval
+    rows = []
+    for area_code, area in fao_areas:
+        for year in years:
+            rows.append({"Domain Code": "FS", "Domain": "Suite of Food Security Indicators", "Area Code": area_code,
+                         "Area": area, "Element Code": 6121, "Element": "Value", "Item Code": 21035,
+                         "Item": "Cereal import dependency ratio (percent) (3-year average)",
+                         "Year Code": f"{year - 2}{year}", "Year": f"{year - 2}-{year}", "Unit": "%",
+                         "Value": round(rng.uniform(0, 100), 3), "Flag": "F", "Flag Description": "FAO estimate", "Note": ""})
+    pd.DataFrame(rows).to_csv(os.path.join(fixture_dir, "api", "FS.csv"), index=False)
+
+    # Source 4: household surveys, labelled "{country} - {year}" or "{country} - {year}-{year}"
+    rows = []
+    for area_code, area in fao_areas[:n_countries] + (fao_areas[-len(GLOBAL_COUNTRIES):] if global_mode else []):
+        for year in years[::3]:
+            survey = f"{area} - {year}" if year % 2 else f"{area} - {year - 1}-{year}"
+            rows.append({"Domain Code": "HS", "Domain": "Indicators from Household Surveys", "Survey Code": 1,
+                         "Survey": survey, "Breakdown Variable Code": 2307, "Breakdown Variable": "Country-level",
+                         "Breadown by Sex of the Household Head Code": 20000,
+                         "Breadown by Sex of the Household Head": "Total", "Indicator Code": 6067,
+                         "Indicator": "Share of food consumption in total income (Engel ratio)",
+                         "Measure Code": 6076, "Measure": "Mean", "Unit": "%",
+                         "Value": round(rng.uniform(0, 100), 3), "Flag": "", "Flag Description": ""})
+    pd.DataFrame(rows).to_csv(os.path.join(fixture_dir, "api", "HS.csv"), index=False)
+
+    # Source 6: agricultural emissions
+    rows = []
+    for area_code, area in fao_areas:
+        for year in years:
+            rows.append({"Domain Code": "GT", "Domain": "Emissions totals", "Area Code (FAO)": area_code, "Area": area,
+                         "Element Code": 7231, "Element": "Emissions (CO2eq)", "Item Code": 1711,
+                         "Item": "Agriculture total", "Year Code": year, "Year": year, "Unit": "kilotonnes",
+                         "Value": round(rng.uniform(0, 1000), 3), "Flag": "F", "Flag Description": "", "Note": ""})
+    pd.DataFrame(rows).to_csv(os.path.join(fixture_dir, "api", "GT.csv"), index=False)
+
+    # World Bank: one list of entries per indicator code, and the list of countries with the aggregates
+    wb_countries = [(get_country_codes(country, index)[0], WB_COUNTRY_NAMES.get(country, country))
+                    for index, country in enumerate(countries)]
+    if global_mode:
+        wb_countries += [(iso3, country) for iso3, country, _, _ in GLOBAL_COUNTRIES]
+        wb_countries.append(("WLD", "World"))
+    for code in main.WorldBank.codes:
+        values = random_values(rng, len(wb_countries) * len(years), missing=0.3)
+        entries = [{"country": {"value": country}, "countryiso3code": iso3,
+                    "date": str(year), "value": values[index * len(years) + year_index]}
+                   for index, (iso3, country) in enumerate(wb_countries) for year_index, year in enumerate(years)]
+        with open(os.path.join(fixture_dir, "wb", code + ".json"), "w") as wb_file:
+            json.dump(entries, wb_file)
+    with open(os.path.join(fixture_dir, "wb", "countries.json"), "w") as wb_file:
+        json.dump([{"id": iso3, "name": country,
+                    "region": {"value": "Aggregates" if iso3 == "WLD" else "Synthetic region"}}
+                   for iso3, country in wb_countries], wb_file)
+
+    return countries
+
+
+def make_handler(fixture_dir, drop_connections=False):
+    '''
+    Request handler serving the fixtures with the same paths and pagination as the real endpoints.
+    Files are served with an ETag and support Range requests. With drop_connections, the first response
+    for each file is cut off halfway through, to measure what resuming downloads costs
+    '''
+    dropped_paths = set()
+
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = url.path.strip("/").split("/")
+            if parts[0] == "bulkdownloads":
+                self.sendFile(os.path.join(fixture_dir, "bulk", parts[-1]))
+            elif parts[0] == "api":
+                self.sendFile(os.path.join(fixture_dir, "api", parts[-1] + ".csv"))
+            elif parts[0] == "wb":
+                self.sendWorldBankPage(parts[-1], parse_qs(url.query))
+            elif parts[0] == "wbcountries":
+                self.sendWorldBankPage("countries", parse_qs(url.query))
+            else:
+                self.send_error(404)
+
+        def sendFile(self, path):
+            if not os.path.exists(path):
+                self.send_error(404)
+                return
+            with open(path, "rb") as served_file:
+                body = served_file.read()
+            stat = os.stat(path)
+            etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+            start = 0
+            range_header = self.headers.get("Range", "")
+            if range_header.startswith("bytes=") and self.headers.get("If-Range", etag) == etag:
+                start = int(range_header[len("bytes="):].split("-")[0])
+                if start >= len(body):
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{len(body)}")
+                    self.end_headers()
+                    return
+
+            self.send_response(206 if start else 200)
+            self.send_header("ETag", etag)
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(len(body) - start))
+            if start:
+                self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+            self.end_headers()
+            if drop_connections and path not in dropped_paths:
+                dropped_paths.add(path)
+                self.wfile.write(body[start:start + (len(body) - start) // 2])
+                self.close_connection = True
+                return
+            self.wfile.write(body[start:])
+
+        def sendWorldBankPage(self, code, query):
+            path = os.path.join(fixture_dir, "wb", code + ".json")
+            if not os.path.exists(path):
+                self.sendBody(json.dumps([{"message": [{"key": "Invalid value", "value": code}]}]).encode())
+                return
+            with open(path) as wb_file:
+                entries = json.load(wb_file)
+            per_page = int(query.get("per_page", ["50"])[0])
+            page = int(query.get("page", ["1"])[0])
+            pages = max(1, -(-len(entries) // per_page))
+            metadata = {"page": page, "pages": pages, "per_page": per_page, "total": len(entries)}
+            self.sendBody(json.dumps([metadata, entries[(page - 1) * per_page:page * per_page]]).encode())
+
+        def sendBody(self, body):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return FixtureHandler
+
+
+def start_server(fixture_dir, drop_connections=False):
+    '''
+    Starts the local stand-in for the FAO and World Bank servers and points main.py at it
+    '''
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(fixture_dir, drop_connections))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    main.FAO.bulk_url = base_url + "/bulkdownloads/"
+    main.FAO.api_url = base_url + "/api/"
+    main.FAO.areas_url = base_url + "/api/area"
+    main.WorldBank.api_url = base_url + "/wb/"
+    main.WorldBank.countries_url = base_url + "/wbcountries"
+    return server
+
+
+class SqliteCursor:
+    '''
+    Lets upload_table run against sqlite by splitting the multi-statement batches it sends,
+    and translating the statements that drop, rename, and list tables
+    '''
+    drop_pattern = re.compile(r"\s*IF OBJECT_ID\(N'(\w+)', N'(\w)'\) IS NOT NULL DROP (VIEW|TABLE) (\w+)\s*")
+    rename_pattern = re.compile(r"\s*EXEC sp_rename '(\w+)', '(\w+)'\s*")
+    tables_pattern = re.compile(r"\s*SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME LIKE '([^']+)'\s*")
+
+    def __init__(self, connection):
+        self.cursor = connection.cursor()
+        self.fast_executemany = False
+
+    def execute(self, sql, *params):
+        if params:
+            self.cursor.execute(sql, params)
+        else:
+            for statement in sql.split(";"):
+                if statement.strip():
+                    self.cursor.execute(self.translate(statement))
+        return self
+
+    def translate(self, statement):
+        drop = self.drop_pattern.fullmatch(statement)
+        if drop:
+            name, _, kind, _ = drop.groups()
+            exists = self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type = ? AND name = ?",
+                                         (kind.lower(), name)).fetchall()
+            return f"DROP {kind} {name}" if exists else "SELECT 1"
+        rename = self.rename_pattern.fullmatch(statement)
+        if rename:
+            return f"ALTER TABLE {rename.group(1)} RENAME TO {rename.group(2)}"
+        tables = self.tables_pattern.fullmatch(statement)
+        if tables:
+            # SQL Server escapes a literal _ as [_] in LIKE patterns
+            pattern = tables.group(1).replace("[_]", "\\_")
+            return f"SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE '{pattern}' ESCAPE '\\'"
+        return statement
+
+    def executemany(self, sql, rows):
+        self.cursor.executemany(sql, rows)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+
+def connect_to_benchmark_db(args):
+    '''
+    Returns the connection and cursor of the database the benchmark uploads to, and a function that opens
+    more connections to it for uploading tables in parallel (None for an in-memory sqlite database)
+    '''
+    if args.odbc:
+        connect = lambda: main.pyodbc.connect(args.odbc, autocommit=False)
+        connection = connect()
+        cursor = connection.cursor()
+        cursor.fast_executemany = True
+        return connection, cursor, connect
+    # sqlite has no MERGE, table-valued parameters, or SQL Server index types
+    main.UPLOAD_MODE = "replace"
+    main.UPLOAD_USE_TVP = False
+    main.UPLOAD_CREATE_INDEXES = False
+    # sqlite only has one writer at a time, so parallel uploads wait for each other's transactions
+    connect = lambda: SqliteConnection(sqlite3.connect(args.sqlite, timeout=600, check_same_thread=False))
+    connection = connect()
+    return connection, connection.cursor(), None if args.sqlite == ":memory:" else connect
+
+
+class SqliteConnection:
+    # Hands out SqliteCursors, so the upload workers' connections behave like pyodbc ones
+    def __init__(self, connection):
+        self.connection = connection
+
+    def cursor(self):
+        return SqliteCursor(self.connection)
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def run_once(args):
+    '''
+    Runs every stage once and returns the seconds each one took.
+    main.metrics is reset first, so afterwards it holds the bytes, rows and memory of this run's stages
+    '''
+    timings = {}
+    main.metrics = main.RunMetrics()
+
+    def timed(name, function, *func_args, **func_kwargs):
+        start = time.perf_counter()
+        value = function(*func_args, **func_kwargs)
+        timings[name] = timings.get(name, 0) + time.perf_counter() - start
+        return value
+
+    world_bank = timed("WorldBank", main.WorldBank)
+
+    fao = main.FAO(fetch=False)
+    for number, region in fao.getTasks():
+        timed(f"FAO.source{number}", getattr(fao, f"source{number}"), *([region] if region else []))
+    fao = timed("FAO (all sources)", main.FAO)
+    timed("evict_download_cache", main.evict_download_cache)
+
+    # Times each upload on its own, the rest of aggregate_and_upload_data is the transform.
+    # Uploads run in parallel when the database allows more than one connection, so their times can overlap
+    upload_table = main.upload_table
+    def timed_upload_table(connection, cursor, df, table_name, *upload_args, **upload_kwargs):
+        return timed(f"upload_table {table_name}", upload_table, connection, cursor, df, table_name,
+                     *upload_args, **upload_kwargs)
+
+    connection, cursor, connect = connect_to_benchmark_db(args)
+    main.upload_table = timed_upload_table
+    try:
+        timed("aggregate_and_upload_data", main.aggregate_and_upload_data, [world_bank.df, fao.df], connection, cursor,
+              connect=connect)
+    finally:
+        main.upload_table = upload_table
+        connection.close()
+    return timings
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the dashboard data pipeline")
+    parser.add_argument("--countries", type=int, default=len(main.countries), help="number of countries in the fixtures")
+    parser.add_argument("--indicators", type=int, default=50, help="number of extra items in each FAO bulk file")
+    parser.add_argument("--years", type=int, default=60, help="number of years in the fixtures")
+    parser.add_argument("--repeat", type=int, default=1, help="number of times to run every stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--global", dest="global_mode", action="store_true",
+                        help="run in GLOBAL_MODE, with the FAO bulk files split by region")
+    parser.add_argument("--drop-connections", action="store_true",
+                        help="cut off the first download of each FAO file halfway through, so every one is resumed")
+    parser.add_argument("--sqlite", default=":memory:", help="sqlite database to upload to")
+    parser.add_argument("--odbc", help="pyodbc connection string of a local SQL Server to upload to instead of sqlite")
+    parser.add_argument("--cache-dir", help="download cache directory, by default every run downloads everything")
+    parser.add_argument("--output", help="json file to write the timings to")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="dashboard_benchmark_")
+    fixture_dir = os.path.join(work_dir, "fixtures")
+    countries = generate_fixtures(fixture_dir, args.countries, args.indicators, args.years, seed=args.seed,
+                                  global_mode=args.global_mode)
+
+    # Makes the synthetic countries part of the dashboard so they aren't filtered out
+    main.countries[:] = countries
+    main.GLOBAL_MODE = args.global_mode
+    main.DOWNLOAD_CACHE_DIR = args.cache_dir
+    server = start_server(fixture_dir, args.drop_connections)
+
+    # Sources that save files do so in the working directory
+    previous_dir = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        runs = [run_once(args) for _ in range(args.repeat)]
+    finally:
+        os.chdir(previous_dir)
+        server.shutdown()
+
+    report = {"scale": {"countries": args.countries, "indicators": args.indicators, "years": args.years,
+                        "repeat": args.repeat, "global": args.global_mode},
+              "timings": {},
+              "last_run_stages": main.metrics.stages}
+    print(f"\n{'stage':<40} {'median (s)':>12} {'min (s)':>12}")
+    for stage in runs[0]:
+        seconds = [run[stage] for run in runs]
+        report["timings"][stage] = {"median": statistics.median(seconds), "min": min(seconds)}
+        print(f"{stage:<40} {statistics.median(seconds):>12.3f} {min(seconds):>12.3f}")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main_benchmark()
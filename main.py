@@ -1,20 +1,53 @@
 #importing the libraries necessary to request and transform indicator data
 import sys
-import pandas as pd
-import requests
+import argparse
+import importlib
 import json
-import numpy as np
 import os
 import zipfile
+import zlib
 import json # Needed for handling JSON
-import csv # Needed for writing to csv
 import urllib
 import glob
+import hashlib # Needed for naming files in the download cache
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED # Needed for fetching indicators concurrently
+import multiprocessing # Needed for running the FAO sources in parallel
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource # Needed for measuring peak memory, not available on Windows
+except ImportError:
+    resource = None
+
+
+class LazyModule:
+    '''
+    Stands in for a module that is only imported the first time one of its attributes is used, and then replaces
+    itself with the module. Commands that don't need pandas, numpy, requests, or pyodbc don't spend any time
+    importing them, and pyodbc is only needed to upload
+    '''
+
+    def __init__(self, module_name, global_name):
+        self.module_name = module_name
+        self.global_name = global_name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.module_name)
+        globals()[self.global_name] = module
+        return getattr(module, attr)
 
+
+pd = LazyModule("pandas", "pd")
+np = LazyModule("numpy", "np")
+requests = LazyModule("requests", "requests")
 # pyodbc may not be included in the python standard library and would require a pip install
 # if this is the case, install it with pip via "pip install pyodbc" within your environment
 # For additional support, access the module's docs here: https://pypi.org/project/pyodbc/
-import pyodbc
+pyodbc = LazyModule("pyodbc", "pyodbc")
 
 '''
 DxHub project: Early action for Early Action (Evaluating Food Security Risk)
@@ -26,13 +59,37 @@ Currently this code focuses on Latin America, but more countries can be included
 list below.
 '''
 
-# Expecting a Microsoft SQL Server
+# Every setting in this file can also be set without editing it, in the json config file at CONFIG_PATH (or the one
+# given with --config), ex: {"DB_SERVER": "...", "countries": ["Chile", "Peru"]}, or in an environment variable named
+# DASHBOARD_ followed by the setting, ex: DASHBOARD_DB_SERVER, which takes precedence over the config file.
+# Environment variables of settings that aren't text are json, ex: DASHBOARD_GLOBAL_MODE=true
+CONFIG_PATH = "config.json"
+
+# Expecting a Microsoft SQL Server. The endpoint, port, username, and password have to be set before uploading
 DB_DRIVER = "SQL Server"
-DB_PORT = # database port
-DB_SERVER = # database endpoint
+DB_PORT = None # database port
+DB_SERVER = None # database endpoint
 DB_DATABASE= "Dashboard"
-DB_USER = # database username
-DB_PASSWORD = # database password
+DB_USER = None # database username
+DB_PASSWORD = None # database password
+
+# How tables are uploaded. "replace" drops, recreates, and reinserts every table on each run,
+# "upsert" merges every table into the existing one, only the rows that changed are written
+UPLOAD_MODE = "replace"
+
+# Rows are sent to the database in batches of this size. With UPLOAD_USE_TVP each batch is sent as one
+# table-valued parameter to a stored procedure instead of an array of parameters (SQL Server only). The
+# table type and procedure are created for each load and dropped once it is done
+UPLOAD_BATCH_SIZE = 10000
+UPLOAD_USE_TVP = False
+
+# Whether the indexes declared for each table are built after its rows are loaded
+UPLOAD_CREATE_INDEXES = True
+
+# Number of database connections that tables are uploaded over at the same time. Each table is loaded into a
+# shadow table (ex: Final_Load) and all of them replace the dashboard's tables in one transaction at the end,
+# so the dashboard never sees a missing or half loaded table. 1 uploads one table at a time
+UPLOAD_CONNECTIONS = 4
 
 
 # List of countries to be included in the dashboard
@@ -43,35 +100,382 @@ countries = ['Argentina', 'Brazil', 'Mexico', 'El Salvador', 'Haiti', 'Colombia'
              'Barbados', 'Cuba', 'Grenada', 'Guyana', 'St. Kitts and Nevis', 
              'St. Lucia', 'St. Vincent and the Grenadines', 'Suriname', 
              'Trinidad and Tobago', 'Dominican Republic']
+
+# ISO3 code and FAO area code of each country in the list above. Rows are matched to a country by these codes
+# wherever a source has them, so each source's spelling of the name doesn't matter
+COUNTRY_CODES = {'Antigua and Barbuda': ('ATG', 8), 'Argentina': ('ARG', 9), 'Bahamas': ('BHS', 12),
+                 'Barbados': ('BRB', 14), 'Belize': ('BLZ', 23), 'Bolivia': ('BOL', 19), 'Brazil': ('BRA', 21),
+                 'Chile': ('CHL', 40), 'Colombia': ('COL', 44), 'Costa Rica': ('CRI', 48), 'Cuba': ('CUB', 49),
+                 'Dominica': ('DMA', 55), 'Dominican Republic': ('DOM', 56), 'Ecuador': ('ECU', 58),
+                 'El Salvador': ('SLV', 60), 'Grenada': ('GRD', 86), 'Guatemala': ('GTM', 89), 'Guyana': ('GUY', 91),
+                 'Haiti': ('HTI', 93), 'Honduras': ('HND', 95), 'Jamaica': ('JAM', 109), 'Mexico': ('MEX', 138),
+                 'Nicaragua': ('NIC', 157), 'Panama': ('PAN', 166), 'Paraguay': ('PRY', 169), 'Peru': ('PER', 170),
+                 'St. Kitts and Nevis': ('KNA', 188), 'St. Lucia': ('LCA', 189),
+                 'St. Vincent and the Grenadines': ('VCT', 191), 'Suriname': ('SUR', 207),
+                 'Trinidad and Tobago': ('TTO', 220), 'Uruguay': ('URY', 234), 'Venezuela': ('VEN', 236)}
+
+# Other spellings of the names above, for sources that only have the name (ex: FAO's household survey labels)
+COUNTRY_ALIASES = {'Venezuela, RB': 'VEN', 'Venezuela (Bolivarian Republic of)': 'VEN',
+                   'Bahamas, The': 'BHS', 'Bolivia (Plurinational State of)': 'BOL',
+                   'Saint Kitts and Nevis': 'KNA', 'Saint Lucia': 'LCA',
+                   'Saint Vincent and the Grenadines': 'VCT'}
+
+# Set GLOBAL_MODE to True to include every country in the world instead of the countries list above.
+# FAO's bulk files are then downloaded per region (see FAO.regions) and each region is processed
+# in parallel on its own, so memory is bounded by the largest region instead of the whole world
+GLOBAL_MODE = False
+
+
+# Hard coded maps to map indicator names to the category they belong to.
+# Currently the category is the source of the data
+INDICATOR_CATEGORIES = {
+    "World Bank" : ['WB Official exchange rate (LCU per US$, period average)',
+                    'WB Food exports (% of merchandise exports)',
+                    'WB Food imports (% of merchandise imports)',
+                    'WB Agriculture, forestry, and fishing, value added (% of GDP)',
+                    'WB Agriculture, forestry, and fishing, value added (annual % growth)',
+                    'WB Personal remittances, received (% of GDP)',
+                    'WB Annual freshwater withdrawals, agriculture (% of total freshwater withdrawal)',
+                    'WB Adjusted net national income per capita (annual % growth)',
+                    'WB Gini Index (WB estimate)',
+                    'WB Income share held by highest 10%',
+                    'WB Income share held by highest 20%',
+                    'WB Income share held by lowest 10%',
+                    'WB Income share held by lowest 20%',
+                    'WB Employment in Agriculture',
+                    'WB Employment in agriculture - female (% of female employment) (modeled ILO estimate)',
+                    'WB Agricultural irrigated land (% of total agricultural land)',
+                    'WB Adequacy of social safety net programs (% of total welfare of beneficiary households)',
+                    'WB Adequacy of unemployment benefits and ALMP (% of total welfare of beneficiary households)',
+                    'WB Prevalence of moderate or severe food insecurity in the population (%)',
+                    'WB Prevalence of severe food insecurity in the population (%)',
+                    'WB Poverty headcount ratio at national poverty lines (% of population)',
+                    'WB Multidimensional Poverty Headcount Ratio, children (% of population ages 0-17)',
+                    'WB Multidimensional poverty headcount ratio (% of total population)',
+                    'WB Multidimensional poverty headcount ratio, female (% of female population)'],
+    "FAO" : ['FAO Crop and livestock exports - quantity (tonnes)',
+            'FAO Crop and livestock exports - value (1000 US$)',
+            'FAO Crop and livestock imports - quantity (tonnes)',
+            'FAO Crop and livestock imports - value (1000 US$)',
+            'FAO Per capita food supply variability (kcal/cap/day)',
+            'FAO Percentage of population using at least basic drinking water services (percent)',
+            'FAO Prevalence of anemia among women of reproductive age (15-49 years)',
+            'FAO Prevalence of low birthweight (percent)',
+            'FAO Prevalence of obesity in the adult population (18 years and older)',
+            'FAO Per capita food production variability (constant 2004-2006 thousand int$ per capita)',
+            'FAO Average dietary energy supply adequacy (percent) (3-year average)',
+            'FAO Average protein supply (g/cap/day) (3-year average)',
+            'FAO Cereal import dependency ratio (percent) (3-year average)',
+            'FAO Share of dietary energy supply derived from cereals, roots and tubers (kcal/cap/day) (3-year average)',
+            'FAO Percentage of children under 5 years affected by wasting (percent)',
+            'FAO Percentage of children under 5 years of age who are overweight (percent)',
+            'FAO Percentage of children under 5 years of age who are stunted (percent)',
+            'FAO Employment-to-population ratio, rural areas (%)',
+            'FAO Employment-to-population ratio, rural areas, female (%)',
+            'FAO Share of food consumption in total income (Engel ratio) (mean)']
+}
+
+# Index from each indicator name to its category, built once so categories can be assigned with a single map
+INDICATOR_CATEGORY_INDEX = {indicator: category
+                            for category, category_indicators in INDICATOR_CATEGORIES.items()
+                            for indicator in category_indicators}
+
+
+# Local cache of downloaded files, so sources that haven't changed upstream aren't downloaded again
+# Set DOWNLOAD_CACHE_DIR to None to always download everything
+DOWNLOAD_CACHE_DIR = ".download_cache"
+DOWNLOAD_CACHE_MAX_BYTES = 5 * 1024 * 1024 * 1024 # cached content beyond this size is evicted, least recently used first
+DOWNLOAD_CACHE_MAX_AGE = 30 * 24 * 60 * 60 # seconds before a cached file is downloaded again in full
+
+# A download that drops or gets a server error is retried up to DOWNLOAD_RETRIES times, waiting twice as long
+# before each retry up to DOWNLOAD_MAX_BACKOFF seconds, and resumes from where it stopped instead of starting over
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_MAX_BACKOFF = 60
+
+# Directory to save each source's dataframe to as a compressed parquet file, None keeps everything in memory only
+# Saving parquet files requires pyarrow, which can be installed with "pip install pyarrow"
+PARQUET_DIR = None
+
+# Layout of the uploaded indicator data. "flat" uploads Final and Full_Indicator_Data with the country and indicator
+# names on every row. "star" instead uploads the names once in Dim_Country and Dim_Indicator (which also holds the
+# category) and uploads Fact_Final and Fact_Indicator_Data, which refer to them by small integer ids.
+# "both" uploads both layouts, which is useful while moving a dashboard from one to the other
+OUTPUT_SCHEMA = "flat"
+
+# How the data is uploaded with one column per indicator. "table" uploads Final_Pivoted with a column named after
+# each indicator, which only works for up to PIVOT_MAX_COLUMNS indicators with names of at most 128 characters.
+# "groups" splits the columns over Final_Pivoted_1, Final_Pivoted_2, ... with at most PIVOT_MAX_COLUMNS
+# columns each, named by indicator id ("I12"), and uploads the Pivot_Columns table to look up each column's indicator.
+# "view" doesn't upload anything, it creates a Final_Pivoted view that pivots Final (or Fact_Final) in the database.
+# Its columns are named after each indicator too, so it has the same limits as "table", only "groups" scales past them
+PIVOT_LAYOUT = "table"
+PIVOT_MAX_COLUMNS = 500 # SQL Server allows 1024 columns per table and rows of at most 8060 bytes
+
+# Number of indicators with the largest change per country and year kept in the Top_Movers summary table
+TOP_MOVERS_N = 10
+
+# Every source converts its data to the same column types before handing it on: categorical Country and Indicator
+# (each name is stored once instead of once per row), 16 bit Year, and VALUE_DTYPE Value.
+# "float32" halves the memory of the values, but only keeps about 7 significant digits
+VALUE_DTYPE = "float64"
+
+# Every run records the wall time, bytes downloaded, rows in and out, and peak memory of each stage.
+# They are written to RUN_REPORT_PATH as json and, if METRICS_TEXTFILE_PATH is set, as a Prometheus textfile
+# (ex: "/var/lib/node_exporter/textfile_collector/dashboard.prom" for the node exporter's textfile collector)
+# Set either one to None to not write it
+RUN_REPORT_PATH = "run_report.json"
+METRICS_TEXTFILE_PATH = None
+
+# The run is split into stages (see build_pipeline) whose results are saved to CHECKPOINT_DIR, so a run that fails
+# resumes from the stage that failed instead of fetching everything again. Checkpoints older than CHECKPOINT_MAX_AGE
+# seconds, or made from other settings or inputs, are computed again. Set CHECKPOINT_DIR to None to turn this off
+CHECKPOINT_DIR = ".checkpoints"
+CHECKPOINT_MAX_AGE = 24 * 60 * 60
+
+# "python main.py daemon" keeps running and refreshes every source on its own schedule instead of running once.
+# Each World Bank indicator ("WorldBank.SI.POV.GINI") and each FAO source ("FAO.source2") is refreshed every
+# DAEMON_REFRESH_INTERVALS[name] seconds, or every DAEMON_REFRESH_INTERVALS["WorldBank"] or ["FAO"] seconds if it
+# doesn't have an interval of its own. A refresh or upload that fails is retried after DAEMON_RETRY_INTERVAL seconds
+DAEMON_REFRESH_INTERVALS = {"WorldBank": 24 * 60 * 60, "FAO": 24 * 60 * 60}
+DAEMON_RETRY_INTERVAL = 15 * 60
     
 
-def main():
-    # Names of csv file names for each source, as long as these end in .csv the names shouldn't matter
-    csv_paths = {
-        "World Bank": "WB_Final.csv",
-        "FAO": "FAO_Final.csv"
-    }
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetches the food insecurity indicators and uploads them to the database")
+    parser.add_argument("--config", help=f"json file of settings to use, by default {CONFIG_PATH} if it exists")
+    commands = parser.add_subparsers(dest="command", metavar="command",
+                                     description="run is the default, the other commands run part of it")
+    run_parser = commands.add_parser("run", help="fetch, transform, and upload, resuming a failed run")
+    run_parser.add_argument("--source", action="append", default=[],
+                            help="only fetch this source (ex: fao.source2, fao, worldbank) and rebuild what depends on it, "
+                                 "reading the other sources from the checkpoints of an earlier run. Can be repeated")
+    run_parser.add_argument("--stage", action="append", default=[],
+                            help="only run this stage, reading its inputs from the checkpoints of an earlier run. Can be repeated")
+    run_parser.add_argument("--fresh", action="store_true", help="run every stage again instead of resuming a failed run")
+    fetch_parser = commands.add_parser("fetch", help="fetch the sources and transform each one into a dataframe")
+    fetch_parser.add_argument("--source", action="append", default=[],
+                              help="only fetch this source (ex: fao.source2, fao, worldbank). Can be repeated")
+    commands.add_parser("transform", help="build the Final and Full_Indicator_Data tables from the fetched sources")
+    commands.add_parser("upload", help="upload the transformed tables to the database")
+    commands.add_parser("daemon", help="keep running and refresh each source on its own interval, "
+                                       "see DAEMON_REFRESH_INTERVALS")
+    # Running without a command is the same as "run"
+    parser.set_defaults(command="run", source=[], stage=[], fresh=False)
+    args = parser.parse_args(argv)
+
+    try:
+        load_config(args.config)
+    except ValueError as error:
+        parser.error(str(error))
+    pipeline = build_pipeline()
+    command = args.command
+    if command == "daemon":
+        # Writes a run report after every refresh
+        Daemon(DAEMON_REFRESH_INTERVALS, DAEMON_RETRY_INTERVAL).run()
+        return
+    for stage_name in args.stage:
+        if stage_name not in pipeline.names():
+            parser.error(f"unknown stage {stage_name}, the stages are {pipeline.names()}")
+    try:
+        sources = pipeline.selectSources(args.source)
+    except ValueError as error:
+        parser.error(str(error))
+
+    if command == "fetch":
+        names = sources or pipeline.sources()
+    elif command == "transform":
+        names = ["FAO", "Final", "Full_Indicator_Data"]
+    elif command == "upload":
+        names = ["upload"]
+    elif args.stage or sources:
+        selected = set(pipeline.downstream(sources)) | set(args.stage)
+        names = [name for name in pipeline.names() if name in selected]
+    else:
+        names = None
+
+    # The run report is written even if a stage fails, so failed runs can be alerted on too
+    succeeded = False
+    try:
+        pipeline.run(names, fresh=args.fresh)
+        succeeded = True
+    finally:
+        metrics.writeReport(RUN_REPORT_PATH, succeeded)
+        metrics.writePrometheus(METRICS_TEXTFILE_PATH, succeeded)
+
+
+def load_config(path=None):
+    '''
+    Overrides the settings at the top of this file with the ones in the json config file at path (CONFIG_PATH by
+    default, which doesn't have to exist), and then with the DASHBOARD_ environment variables.
+    Raises a ValueError for a setting in the config file that doesn't exist or a value that isn't valid json.
+    Environment variables that aren't settings are skipped with a warning, since other programs may use the prefix too
+    '''
+    setting_names = get_setting_names()
+    settings = {}
+    config_path = CONFIG_PATH if path is None else path
+    if path is not None or (config_path is not None and os.path.exists(config_path)):
+        with open(config_path) as config_file:
+            for key, value in json.load(config_file).items():
+                if key.upper() not in setting_names:
+                    raise ValueError(f"Unknown setting {key} in {config_path}")
+                settings[setting_names[key.upper()]] = value
+    for key, value in os.environ.items():
+        if not key.startswith("DASHBOARD_"):
+            continue
+        setting = key[len("DASHBOARD_"):]
+        if setting not in setting_names:
+            print(f"Warning: ignoring the environment variable {key}, there is no setting called {setting}", file=sys.stderr)
+            continue
+        name = setting_names[setting]
+        if isinstance(globals()[name], (str, type(None))):
+            settings[name] = value
+            continue
+        try:
+            settings[name] = json.loads(value)
+        except ValueError:
+            raise ValueError(f"The environment variable {key} isn't valid json: {value}")
+    apply_settings(settings)
+
+
+def get_setting_names():
+    # Settings are the constants of this file that hold plain values, plus the countries list, by their upper case name
+    return {name.upper(): name for name, value in globals().items()
+            if (name.isupper() or name == "countries") and name != "INDICATOR_CATEGORY_INDEX"
+            and isinstance(value, (str, int, float, list, dict, type(None)))}
+
+
+def get_settings():
+    '''
+    Returns the current value of every setting, to hand them on to worker processes with apply_settings()
+    '''
+    return {name: globals()[name] for name in get_setting_names().values()}
+
+
+def apply_settings(settings):
+    '''
+    Sets the settings in the dict of {name: value}
+    '''
+    for name, value in settings.items():
+        if name == "countries":
+            # Changed in place, since other objects hold on to the list
+            countries[:] = value
+        else:
+            globals()[name] = value
+    if "INDICATOR_CATEGORIES" in settings:
+        global INDICATOR_CATEGORY_INDEX
+        INDICATOR_CATEGORY_INDEX = {indicator: category
+                                    for category, category_indicators in INDICATOR_CATEGORIES.items()
+                                    for indicator in category_indicators}
+
+
+def build_pipeline():
+    '''
+    Returns the stages of a run. Each source is fetched and transformed into one dataframe, the World Bank as one
+    source and each FAO source on its own (saved as parquet files too if PARQUET_DIR is set), the sources are
+    combined into the Final and Full_Indicator_Data tables, and everything is uploaded.
+    The settings of each stage are the constants its output depends on
+    '''
+    pipeline = Pipeline(CHECKPOINT_DIR, CHECKPOINT_MAX_AGE)
+    # The download cache is trimmed once every stage has finished, the hooks are closed in reverse order
+    pipeline.addHooks(lambda names: None, evict_download_cache)
+    fao_sources = FAOSourceRunner()
+    pipeline.addHooks(fao_sources.start, fao_sources.close)
+
+    pipeline.add("WorldBank", lambda: WorldBank(get_parquet_path("WB_Final")).df,
+                 settings=lambda: [WorldBank.api_url, WorldBank.codes, countries, GLOBAL_MODE, WorldBank.countries_url,
+                                   FAO.areas_url, COUNTRY_CODES, COUNTRY_ALIASES, VALUE_DTYPE])
+    fao_source_names = []
+    for number in range(1, 7):
+        fao_source_names.append(f"FAO.source{number}")
+        pipeline.add(fao_source_names[-1], lambda number=number: fao_sources.run(number),
+                     settings=lambda: [FAO.bulk_url, FAO.api_url, FAO.regions, countries, GLOBAL_MODE,
+                                       WorldBank.countries_url, FAO.areas_url, COUNTRY_CODES, COUNTRY_ALIASES, VALUE_DTYPE])
+    pipeline.add("FAO", lambda *source_dfs: fao_sources.combine(source_dfs, get_parquet_path("FAO_Final")),
+                 inputs=fao_source_names, settings=lambda: [GLOBAL_MODE])
+    # Assuming that all dataframes have the same schema (["Country", "Year", "Indicator", "Value"])
+    pipeline.add("Final", lambda wb_df, fao_df: combine_sources([wb_df, fao_df]), inputs=["WorldBank", "FAO"],
+                 settings=lambda: [PIVOT_LAYOUT, PIVOT_MAX_COLUMNS])
+    pipeline.add("Full_Indicator_Data", compute_indicator_data, inputs=["Final"],
+                 settings=lambda: [INDICATOR_CATEGORIES])
+    pipeline.add("upload", upload_to_db, inputs=["Final", "Full_Indicator_Data"])
+    return pipeline
+
+
+def upload_to_db(final_df, full_indicator_data_df):
+    '''
+    Connects to the database and uploads every table. The connection is only opened once the data is ready
+    '''
     print("Connecting to database...")
     connection = connect_to_db()
     cursor = connection.cursor()
     cursor.fast_executemany = True
     print("Database connected")
-    
-    # fetch and format data
-    print("Fetching data and transforming it into one csv per source")
-    WorldBank(csv_paths["World Bank"])
-    FAO(csv_paths["FAO"])
-    
-    # Assuming that all CSV files in csv_paths have the same schema (["Country", "Year", "Indicator", "Value"]),
-    # This command will aggregate the files and upload all the rows to the database
-    aggregate_and_upload_data(list(csv_paths.values()), connection, cursor)
-    
+    upload_indicator_tables(final_df, full_indicator_data_df, connection, cursor, connect=open_db_connection)
+
+
+def get_parquet_path(name):
+    '''
+    Returns the path to save a dataframe called name to, or None if dataframes aren't being persisted
+    '''
+    if PARQUET_DIR is None:
+        return None
+    os.makedirs(PARQUET_DIR, exist_ok=True)
+    return os.path.join(PARQUET_DIR, name + ".parquet")
+
+
+def save_parquet(df, path):
+    '''
+    Saves the dataframe as a compressed parquet file if a path is given
+    '''
+    if path is not None:
+        df.to_parquet(path, compression="zstd", index=False)
+
+
+def apply_source_schema(df):
+    '''
+    Returns the Country, Year, Indicator, and Value columns of the dataframe converted to the types every source
+    shares. Raises an error if a year isn't a whole number
+    '''
+    return pd.DataFrame({"Country": df["Country"].astype("category"),
+                         "Year": df["Year"].astype("int16"),
+                         "Indicator": df["Indicator"].astype("category"),
+                         "Value": df["Value"].astype(VALUE_DTYPE)})
+
+
+def concat_source_dfs(source_dfs):
+    '''
+    Concatenates dataframes in the source schema. The categories of each categorical column are merged
+    first, otherwise pandas falls back to plain strings whenever the categories differ. They are kept
+    sorted, so sorting by a categorical column gives the same order as sorting the names
+    '''
+    source_dfs = list(source_dfs)
+    for col in ("Country", "Indicator"):
+        categories = pd.api.types.union_categoricals([source_df[col] for source_df in source_dfs], sort_categories=True).categories
+        source_dfs = [source_df.assign(**{col: source_df[col].cat.set_categories(categories)})
+                      for source_df in source_dfs]
+    return pd.concat(source_dfs, ignore_index=True)
+
+
+def hash_dataframe(df):
+    '''
+    Returns a hash of the column names, types, and values of a dataframe, to tell whether its content changed
+    '''
+    sha256 = hashlib.sha256()
+    sha256.update(json.dumps([[str(col), str(dtype)] for col, dtype in df.dtypes.items()]).encode())
+    sha256.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return sha256.hexdigest()
+
 
 def connect_to_db():
     '''
     Uses pyodbc to connect to a database. It checks if the database, DB_DATABASE, has been created. If not, then
     it creates it before returning the connection.
     '''
+    missing = [name for name in ("DB_PORT", "DB_SERVER", "DB_USER", "DB_PASSWORD") if globals()[name] is None]
+    if missing:
+        raise ValueError(f"{', '.join(missing)} not set, set them at the top of main.py, in {CONFIG_PATH}, "
+                         f"or as DASHBOARD_ environment variables (ex: DASHBOARD_{missing[0]})")
+
     # Checks to see if initial database connection is possible and if the database needs to be created or not
     test_connection = pyodbc.connect(f'DRIVER={DB_DRIVER};PORT={DB_PORT};SERVER={DB_SERVER};UID={DB_USER};PWD={DB_PASSWORD};autocommit=False')
     test_cursor = test_connection.cursor()
@@ -84,171 +488,488 @@ def connect_to_db():
     test_cursor.close()
     test_connection.close()
     
+    return open_db_connection()
+
+
+def open_db_connection():
+    '''
+    Opens a new connection to DB_DATABASE, which has to exist already
+    '''
     return pyodbc.connect(f'DRIVER={DB_DRIVER};PORT={DB_PORT};SERVER={DB_SERVER};DATABASE={DB_DATABASE};UID={DB_USER};PWD={DB_PASSWORD};autocommit=False')
 
     
-def aggregate_and_upload_data(csv_paths, connection, cursor):
+def is_pyodbc_cursor(cursor):
+    # A pyodbc cursor can only exist once pyodbc has been imported, so other cursors (ex: the benchmark's sqlite one)
+    # never make it, and the ODBC driver manager it needs, get loaded
+    module = sys.modules.get("pyodbc")
+    return module is not None and isinstance(cursor, module.Cursor)
+
+
+def get_input_sizes(schema):
     '''
-    Reads in the csv files, combines the data into one dataframe, and then uploads data to datbase
-    in different formats
+    Explicit parameter types and sizes for each column in the schema, so fast_executemany
+    doesn't have to guess them from the first batch of values
     '''
-    def rel_diff(a, b):
-        # calculates the "relative percent difference" as explained here: 
-        # https://stats.stackexchange.com/questions/86708/how-to-calculate-relative-error-when-the-true-value-is-zero
-        if a==0 or b==0: 
-            return 0
-        return 2 * ((b - a) / (abs(a) + abs(b)))
+    input_sizes = []
+    for name_type in schema:
+        sql_type = name_type[1].upper().replace(" ", "")
+        base_type = sql_type.split("(")[0]
+        length = 0
+        if "(" in sql_type and "MAX" not in sql_type:
+            length = int(sql_type.split("(")[1].split(")")[0].split(",")[0])
+        if base_type in ("NCHAR", "NVARCHAR"):
+            input_sizes.append((pyodbc.SQL_WVARCHAR, length, 0))
+        elif base_type in ("CHAR", "VARCHAR"):
+            input_sizes.append((pyodbc.SQL_VARCHAR, length, 0))
+        elif base_type == "INT":
+            input_sizes.append((pyodbc.SQL_INTEGER, 0, 0))
+        elif base_type == "SMALLINT":
+            input_sizes.append((pyodbc.SQL_SMALLINT, 0, 0))
+        elif base_type == "BIT":
+            input_sizes.append((pyodbc.SQL_BIT, 0, 0))
+        elif base_type == "REAL":
+            input_sizes.append((pyodbc.SQL_REAL, 0, 0))
+        elif base_type == "FLOAT":
+            input_sizes.append((pyodbc.SQL_DOUBLE, 0, 0))
+        else:
+            # Lets the driver decide
+            input_sizes.append(None)
+    return input_sizes
 
-    
-    def check_rankings(rankings):
-        '''
-        if all rankings are the same, then the relative ranking is not useful and we don't want this to skewing
-        the results when searching for the most impactful indicators. 
-        ex: Since we are measuring relative differences, the first indicator's year will always be made up of the same values.
-        If all rankings are the same, then all rankings will become 1
-        '''
-        if len(rankings) <= 1:
-            return rankings
-        replacement_rankings = []
-        previous_rank = rankings[0]
-        for rank in rankings[1:]:
-            if rank != previous_rank:
-                return rankings
-            else:
-                replacement_rankings.append(1)
-        replacement_rankings.append(1)  # accounts for the append missed by not iterating over the first value
-        return replacement_rankings
-    
-    
-    def get_indicator_category(indicator):
-        '''
-        Hard coded maps to map indicator names to the category they belong to.
-        Currently the category is the source of the data
-        '''
-        indicator_map = {
-            "World Bank" : ['WB Official exchange rate (LCU per US$, period average)',
-                            'WB Food exports (% of merchandise exports)',
-                            'WB Food imports (% of merchandise imports)',
-                            'WB Agriculture, forestry, and fishing, value added (% of GDP)',
-                            'WB Agriculture, forestry, and fishing, value added (annual % growth)',
-                            'WB Personal remittances, received (% of GDP)',
-                            'WB Annual freshwater withdrawals, agriculture (% of total freshwater withdrawal)',
-                            'WB Adjusted net national income per capita (annual % growth)',
-                            'WB Gini Index (WB estimate)',
-                            'WB Income share held by highest 10%',
-                            'WB Income share held by highest 20%',
-                            'WB Income share held by lowest 10%',
-                            'WB Income share held by lowest 20%',
-                            'WB Employment in Agriculture',
-                            'WB Employment in agriculture - female (% of female employment) (modeled ILO estimate)',
-                            'WB Agricultural irrigated land (% of total agricultural land)',
-                            'WB Adequacy of social safety net programs (% of total welfare of beneficiary households)',
-                            'WB Adequacy of unemployment benefits and ALMP (% of total welfare of beneficiary households)',
-                            'WB Prevalence of moderate or severe food insecurity in the population (%)',
-                            'WB Prevalence of severe food insecurity in the population (%)',
-                            'WB Poverty headcount ratio at national poverty lines (% of population)',
-                            'WB Multidimensional Poverty Headcount Ratio, children (% of population ages 0-17)',
-                            'WB Multidimensional poverty headcount ratio (% of total population)',
-                            'WB Multidimensional poverty headcount ratio, female (% of female population)'],
-            "FAO" : ['FAO Crop and livestock exports - quantity (tonnes)',
-                    'FAO Crop and livestock exports - value (1000 US$)',
-                    'FAO Crop and livestock imports - quantity (tonnes)',
-                    'FAO Crop and livestock imports - value (1000 US$)',
-                    'FAO Per capita food supply variability (kcal/cap/day)',
-                    'FAO Percentage of population using at least basic drinking water services (percent)',
-                    'FAO Prevalence of anemia among women of reproductive age (15-49 years)',
-                    'FAO Prevalence of low birthweight (percent)',
-                    'FAO Prevalence of obesity in the adult population (18 years and older)',
-                    'FAO Per capita food production variability (constant 2004-2006 thousand int$ per capita)',
-                    'FAO Average dietary energy supply adequacy (percent) (3-year average)',
-                    'FAO Average protein supply (g/cap/day) (3-year average)',
-                    'FAO Cereal import dependency ratio (percent) (3-year average)',
-                    'FAO Share of dietary energy supply derived from cereals, roots and tubers (kcal/cap/day) (3-year average)',
-                    'FAO Percentage of children under 5 years affected by wasting (percent)',
-                    'FAO Percentage of children under 5 years of age who are overweight (percent)',
-                    'FAO Percentage of children under 5 years of age who are stunted (percent)',
-                    'FAO Employment-to-population ratio, rural areas (%)',
-                    'FAO Employment-to-population ratio, rural areas, female (%)',
-                    'FAO Share of food consumption in total income (Engel ratio) (mean)']
-        }
-        for category_indicators in indicator_map.items():
-            if indicator in category_indicators[1]:
-                return category_indicators[0]
-        print(indicator)
-        return "None"
-    
-    
-    def fix_null_values(values):
-        '''
-        For rows of values, if any of the values are "nan", this function changes them to None.
-        '''
-        new_values = []
-        for row in values:
-            new_row = []
-            for val in row:
-                if str(val) == "nan":
-                    new_row.append(None)
-                else:
-                    new_row.append(val)
-            new_values.append(new_row)
-        return new_values
-    
 
-    def upload_table(connection, cursor, df, table_name, schema):
-        '''
-        Takes in the pyodbc connection and cursor, a dataframe full of values, the table name
-        in the database to allocate those values, and the database schema to define datatypes and
-        relations for inserting rows from the dataframe
-        
-        schema is in the form of [(column name, data type), ...] and should match the order of the
-        columns in the dataframe
-        '''
+def iter_row_batches(df):
+    '''
+    Yields the rows of the dataframe as lists of tuples of at most UPLOAD_BATCH_SIZE rows.
+    Each column is converted on its own, with missing values (NaN) becoming None, so only one batch
+    of python objects exists at a time no matter how large the dataframe is
+    '''
+    columns = [df[col] for col in df.columns]
+    for start in range(0, len(df), UPLOAD_BATCH_SIZE):
+        batch_columns = []
+        for column in columns:
+            values = column.iloc[start:start + UPLOAD_BATCH_SIZE]
+            batch_columns.append(values.astype(object).where(values.notna(), None).tolist())
+        yield list(zip(*batch_columns))
+
+
+def insert_rows(cursor, df, table_name, schema):
+    '''
+    Inserts every row of the dataframe into the table in bounded batches. Assumes dataframe column order
+    is the same as the schema. If UPLOAD_USE_TVP is True the batches are sent as table-valued parameters
+    to a stored procedure instead of parameter arrays
+    '''
+    sql_cols = ", ".join(name_type[0] for name_type in schema)
+    if UPLOAD_USE_TVP:
+        procedure_name, type_name = create_tvp_procedure(cursor, table_name, schema)
+        for rows in iter_row_batches(df):
+            cursor.execute(f"{{CALL {procedure_name} (?)}}", [rows])
+        # They are only needed for this load, and once a shadow table is swapped in the table they insert
+        # into no longer exists. If the load fails they are left behind until the table is next loaded
+        cursor.execute(
+            f'''
+            DROP PROCEDURE IF EXISTS {procedure_name};
+            DROP TYPE IF EXISTS {type_name};
+            ''')
+        return
+
+    stmt = f'''INSERT INTO {table_name} ({sql_cols}) VALUES ({", ".join("?" * len(schema))})'''
+    # The sizes are given as pyodbc types, other cursors work them out themselves
+    input_sizes = get_input_sizes(schema) if is_pyodbc_cursor(cursor) else None
+    for rows in iter_row_batches(df):
+        if input_sizes is not None:
+            cursor.setinputsizes(input_sizes)
+        cursor.executemany(stmt, rows)
+
+
+def create_tvp_procedure(cursor, table_name, schema):
+    '''
+    Creates a table type matching the schema and a stored procedure that inserts a table-valued parameter
+    of that type into the table. Returns the names of the procedure and of the type
+    '''
+    base_name = table_name.lstrip("#")
+    type_name = f"dbo.{base_name}_Rows"
+    procedure_name = f"dbo.Insert_{base_name}"
+    sql_schema = ", ".join(f"{name_type[0]} {name_type[1]}" for name_type in schema)
+    sql_cols = ", ".join(name_type[0] for name_type in schema)
+    cursor.execute(
+        f'''
+        DROP PROCEDURE IF EXISTS {procedure_name};
+        DROP TYPE IF EXISTS {type_name};
+        CREATE TYPE {type_name} AS TABLE({sql_schema});
+        ''')
+    # CREATE PROCEDURE has to be the only statement in its batch
+    cursor.execute(
+        f'''
+        CREATE PROCEDURE {procedure_name} @rows {type_name} READONLY AS
+        INSERT INTO {table_name} ({sql_cols}) SELECT {sql_cols} FROM @rows;
+        ''')
+    return procedure_name, type_name
+
+
+def get_table_columns(cursor, table_name):
+    '''
+    Returns the column names of the table in the database, or an empty list if the table doesn't exist
+    '''
+    resp = cursor.execute(
+        "SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = ? ORDER BY ORDINAL_POSITION;",
+        table_name).fetchall()
+    return [row[0] for row in resp]
+
+
+def upsert_table(connection, cursor, df, table_name, schema, keys):
+    '''
+    Incrementally updates an existing table so it matches the dataframe. The rows are loaded into a temporary
+    staging table, which is then merged into the table on the key columns by the server: only the rows that are
+    new, changed, or removed are written, and the table is never read back to compare it here.
+    Returns the number of rows that were inserted, updated, or deleted
+    '''
+    df_cols = list(df.columns)
+    sql_names = {col: name_type[0] for col, name_type in zip(df_cols, schema)}
+    value_cols = [col for col in df_cols if col not in keys]
+
+    staging_name = f"#{table_name}_Staging"
+    sql_schema = ", ".join(f"{name_type[0]} {name_type[1]}" for name_type in schema)
+    cursor.execute(
+        f'''
+        DROP TABLE IF EXISTS {staging_name};
+        CREATE TABLE {staging_name}({sql_schema});
+        ''')
+    insert_rows(cursor, df, staging_name, schema)
+
+    match_on = " AND ".join(f"target.{sql_names[key]} = source.{sql_names[key]}" for key in keys)
+    update_clause = ""
+    if value_cols:
+        # EXCEPT compares the values the way DISTINCT does, so NULLs are equal to each other
+        source_values = ", ".join(f"source.{sql_names[col]}" for col in value_cols)
+        target_values = ", ".join(f"target.{sql_names[col]}" for col in value_cols)
+        update_set = ", ".join(f"target.{sql_names[col]} = source.{sql_names[col]}" for col in value_cols)
+        update_clause = (f"WHEN MATCHED AND EXISTS (SELECT {source_values} EXCEPT SELECT {target_values}) "
+                         f"THEN UPDATE SET {update_set}")
+    insert_cols = ", ".join(sql_names[col] for col in df_cols)
+    insert_values = ", ".join(f"source.{sql_names[col]}" for col in df_cols)
+    resp = cursor.execute(
+        f'''
+        SET NOCOUNT ON;
+        MERGE {table_name} WITH (HOLDLOCK) AS target
+        USING {staging_name} AS source
+        ON {match_on}
+        {update_clause}
+        WHEN NOT MATCHED BY TARGET THEN INSERT ({insert_cols}) VALUES ({insert_values})
+        WHEN NOT MATCHED BY SOURCE THEN DELETE;
+        SELECT @@ROWCOUNT;
+        ''').fetchall()
+    changed = int(resp[0][0])
+    cursor.execute(f"SET NOCOUNT OFF; DROP TABLE {staging_name};")
+    connection.commit()
+    print(f"{table_name}: " + (f"{changed} rows inserted, updated, or deleted" if changed else "no changes"))
+    return changed
+
+
+def get_index_name(table_name, kind, columns):
+    if "COLUMNSTORE" in kind.upper():
+        return f"CCI_{table_name}" if kind.upper().startswith("CLUSTERED") else f"NCCI_{table_name}"
+    return f"IX_{table_name}_" + "_".join(col.strip('"').replace(" ", "") for col in columns)
+
+
+def create_indexes(cursor, table_name, indexes, index_table_name=None):
+    '''
+    Builds each index declared for the table that doesn't exist yet. Indexes are in the form of [(kind, columns), ...],
+    where kind is the index type as written in CREATE INDEX (ex: "UNIQUE CLUSTERED", "NONCLUSTERED",
+    "CLUSTERED COLUMNSTORE") and columns is the list of column names, which a clustered columnstore index doesn't take.
+    The indexes are named after index_table_name (table_name by default), so the indexes of a shadow table keep
+    the names of the table it replaces
+    '''
+    for kind, columns in indexes:
+        index_name = get_index_name(index_table_name or table_name, kind, columns)
+        on_cols = f" ({', '.join(columns)})" if columns else ""
+        cursor.execute(
+            f'''
+            IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = '{index_name}' AND object_id = OBJECT_ID('{table_name}'))
+                CREATE {kind.upper()} INDEX {index_name} ON {table_name}{on_cols};
+            ''')
+
+
+def upload_table(connection, cursor, df, table_name, schema, keys=None, indexes=None, load_name=None):
+    '''
+    Takes in the pyodbc connection and cursor, a dataframe full of values, the table name
+    in the database to allocate those values, and the database schema to define datatypes and
+    relations for inserting rows from the dataframe
+
+    schema is in the form of [(column name, data type), ...] and should match the order of the
+    columns in the dataframe
+
+    keys is a list of the dataframe columns that uniquely identify each row. If UPLOAD_MODE is "upsert"
+    and the table already exists with the same columns, only the changes are merged into it on these keys.
+    Otherwise the table is dropped, recreated, and every row is inserted
+
+    indexes is a list of the indexes of the table in the form of [(kind, columns), ...], see create_indexes().
+    They are built once all the rows are loaded, which is faster than loading into an indexed table,
+    and are added to an upserted table that doesn't have them yet
+
+    load_name is the table the rows are loaded into when the table is replaced, table_name by default. It is then
+    up to the caller to swap it in for table_name (see UploadPool). Returns the name of the table that was loaded,
+    or None if the changes were merged into table_name
+    '''
+    with metrics.stage(f"upload_table {table_name}", rows_in=len(df)) as stage:
+        if UPLOAD_MODE == "upsert" and keys is not None:
+            sql_names = [name_type[0].strip('"') for name_type in schema]
+            if get_table_columns(cursor, table_name) == sql_names:
+                stage["rows_out"] = upsert_table(connection, cursor, df, table_name, schema, keys)
+                if indexes and UPLOAD_CREATE_INDEXES:
+                    with metrics.stage(f"create_indexes {table_name}"):
+                        create_indexes(cursor, table_name, indexes)
+                        connection.commit()
+                return None
+
+        load_name = load_name or table_name
         sql_schema = ""
-        sql_cols = ""
-        params_to_sub = ""
         for name_type in schema[:-1]:
             sql_schema += f"{name_type[0]} {name_type[1]},"
-            sql_cols += f"{name_type[0]}, "
-            params_to_sub += "?,"
         sql_schema += f"{schema[-1][0]} {schema[-1][1]}"
-        sql_cols += schema[-1][0]
-        params_to_sub += "?"
 
         cursor.execute(
             f'''
-            DROP TABLE IF EXISTS {table_name};
-            CREATE TABLE {table_name}({sql_schema});
+            DROP TABLE IF EXISTS {load_name};
+            CREATE TABLE {load_name}({sql_schema});
             ''')
 
-        # Assumes dataframe column order is the same as schema
-        df_values = [tuple(x) for x in fix_null_values(df.values)]
-        stmt = f'''INSERT INTO {table_name} ({sql_cols}) VALUES ({params_to_sub})'''
-
-        cursor.executemany(stmt, df_values)
+        insert_rows(cursor, df, load_name, schema)
+        if indexes and UPLOAD_CREATE_INDEXES:
+            with metrics.stage(f"create_indexes {table_name}"):
+                create_indexes(cursor, load_name, indexes, index_table_name=table_name)
         connection.commit()
-        
-        
-        
-    ### Joins then uploads the data into "Final" table
-    final_df_cols = ["Country", "Year", "Indicator", "Value"]
-    final_df = pd.DataFrame(columns=final_df_cols)
-    for path in csv_paths:
-        temp_df = pd.read_csv(path)
-        final_df = final_df.append(temp_df)
+        stage["rows_out"] = len(df)
+        return load_name
 
-    final_df = final_df.sort_values(["Country", "Year", "Indicator"])
-    final_df = final_df.reset_index(drop=True)
 
-    final_df_table_name = "Final"
-    final_df_schema = [("Country", "NCHAR(100)"),
-                       ("Year", "INT"), 
-                       ("Indicator", "NCHAR(500)"),
-                       ("Value", "FLOAT")]
+def drop_table_or_view(cursor, name):
+    '''
+    Drops whatever is called name, a table or a view, if anything is
+    '''
+    cursor.execute(
+        f'''
+        IF OBJECT_ID(N'{name}', N'V') IS NOT NULL DROP VIEW {name};
+        IF OBJECT_ID(N'{name}', N'U') IS NOT NULL DROP TABLE {name};
+        ''')
 
-    upload_table(connection, cursor, final_df, final_df_table_name, final_df_schema)
-    
-    ### Pivots then uploads the data in "Final_Pivoted" table
-    final_pivoted_df = final_df.pivot(index=["Country", "Year"], columns="Indicator", values="Value").reset_index()
+
+class UploadPool:
+    '''
+    Uploads tables at the same time over a small pool of database connections
+
+    upload() queues a table and returns straight away. In "replace" mode each table is loaded into a shadow table
+    (ex: Final_Load) while the dashboard keeps reading the current one, and swap() then replaces every table with
+    its shadow table in a single transaction once all the loads have finished. Readers see either all of the last
+    run's tables or all of this run's, never a dropped or half loaded table, and if any load fails nothing is swapped.
+    Upserted tables are merged in place, each MERGE already being atomic.
+    If uploaded is given, it's a dict of the content hash of every table as of the last swap, which is kept up to
+    date, and tables whose content hasn't changed since aren't uploaded again
+    '''
+
+    load_suffix = "_Load"
+
+    def __init__(self, connection, cursor, connect=None, size=None, uploaded=None):
+        # connect is a function that opens a new connection for each worker thread. Without it, or with a size
+        # of 1, tables are uploaded one at a time over connection
+        self.connection = connection
+        self.cursor = cursor
+        self.connect = connect
+        size = UPLOAD_CONNECTIONS if size is None else size
+        self.executor = ThreadPoolExecutor(max_workers=size) if connect is not None and size > 1 else None
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.worker_connections = []
+        self.pending = []
+        self.swaps = {} # shadow table name -> table name
+        self.drops = []
+        self.uploaded = uploaded
+        self.hashes = {} # table name -> content hash of the tables queued since the last swap
+
+
+    def upload(self, df, table_name, schema, keys=None, indexes=None):
+        '''
+        Queues df to be uploaded to table_name, with the same arguments as upload_table()
+        '''
+        if self.uploaded is not None:
+            content_hash = hash_dataframe(df)
+            if self.uploaded.get(table_name) == content_hash:
+                print(f"{table_name} hasn't changed since it was uploaded")
+                return
+            self.hashes[table_name] = content_hash
+        if self.executor is None:
+            self.uploadTable(self.connection, self.cursor, df, table_name, schema, keys, indexes)
+        else:
+            self.pending.append(self.executor.submit(self.runUpload, df, table_name, schema, keys, indexes))
+
+
+    def drop(self, name):
+        # Drops a table or view when the tables are swapped, ex: a table left over from an older layout
+        self.drops.append(name)
+
+
+    def runUpload(self, *args):
+        # Runs in a worker thread, each of which opens its own connection the first time
+        if not hasattr(self.local, "connection"):
+            self.local.connection = self.connect()
+            self.local.cursor = self.local.connection.cursor()
+            self.local.cursor.fast_executemany = True
+            with self.lock:
+                self.worker_connections.append(self.local.connection)
+        self.uploadTable(self.local.connection, self.local.cursor, *args)
+
+
+    def uploadTable(self, connection, cursor, df, table_name, schema, keys, indexes):
+        load_name = upload_table(connection, cursor, df, table_name, schema, keys=keys, indexes=indexes,
+                                 load_name=table_name + UploadPool.load_suffix)
+        if load_name is not None:
+            with self.lock:
+                self.swaps[load_name] = table_name
+
+
+    def wait(self):
+        '''
+        Waits for every queued upload to finish, raising the error of the first one that failed
+        '''
+        pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+
+    def swap(self):
+        '''
+        Waits for the uploads, then replaces each table with its shadow table and drops the tables queued with drop(),
+        all in one transaction
+        '''
+        self.wait()
+        with metrics.stage("swap_tables"):
+            for name in self.drops:
+                drop_table_or_view(self.cursor, name)
+            for load_name, table_name in self.swaps.items():
+                drop_table_or_view(self.cursor, table_name)
+                self.cursor.execute(f"EXEC sp_rename '{load_name}', '{table_name}';")
+            self.connection.commit()
+        self.swaps = {}
+        self.drops = []
+        if self.uploaded is not None:
+            self.uploaded.update(self.hashes)
+        self.hashes = {}
+
+
+    def close(self):
+        # Also cancels any uploads that haven't started, after a failure
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+        for connection in self.worker_connections:
+            connection.close()
+
+
+def get_dimension(cursor, names, table_name, id_col, name_col):
+    '''
+    Returns a dataframe of the names and a small integer id for each one, to be uploaded as a dimension table.
+    The ids already in table_name are kept in every upload mode, so the keys of the fact rows and the columns of the
+    pivoted groups don't move between runs (and unchanged rows aren't sent again in "upsert" mode).
+    New names get the next unused ids
+    '''
+    names = pd.Series(names, dtype=object)
+    existing_df = pd.DataFrame({id_col: pd.Series(dtype="int64"), name_col: pd.Series(dtype=object)})
+    if {id_col, name_col} <= set(get_table_columns(cursor, table_name)):
+        resp = cursor.execute(f"SELECT {id_col}, {name_col} FROM {table_name};").fetchall()
+        existing_df = pd.DataFrame.from_records([tuple(row) for row in resp], columns=[id_col, name_col])
+        existing_df[id_col] = existing_df[id_col].astype("int64")
+        existing_df[name_col] = existing_df[name_col].str.rstrip()
+
+    next_id = int(existing_df[id_col].max()) + 1 if len(existing_df) > 0 else 1
+    existing_df = existing_df[existing_df[name_col].isin(names)]
+    new_names = names[~names.isin(existing_df[name_col])]
+    new_df = pd.DataFrame({id_col: np.arange(next_id, next_id + len(new_names)), name_col: new_names.to_numpy()})
+
+    dim_df = pd.concat([existing_df, new_df], ignore_index=True)
+    dim_df[id_col] = dim_df[id_col].astype("int16")
+    return dim_df.sort_values(id_col).reset_index(drop=True)
+
+
+def get_dimension_keys(values, dim_df, id_col, name_col):
+    '''
+    Returns the id in the dimension table of each value of a categorical column. Each category is looked up once
+    and the rows are then mapped by their category codes
+    '''
+    ids = pd.Series(dim_df[id_col].to_numpy(), index=dim_df[name_col]).reindex(values.cat.categories)
+    return pd.Series(ids.to_numpy()[values.cat.codes.to_numpy()], index=values.index).astype("int16")
+
+
+def get_used_categories(values):
+    '''
+    Returns the categories of a categorical column that appear in it at least once, in category order
+    '''
+    counts = np.bincount(values.cat.codes.to_numpy()[values.notna().to_numpy()], minlength=len(values.cat.categories))
+    return values.cat.categories[counts > 0]
+
+
+def check_pivot(final_df):
+    '''
+    Raises a ValueError if final_df can't be pivoted with PIVOT_LAYOUT: if a country, year, and indicator has
+    more than one value, or if a "table" or "view" layout would have more columns or longer column names than
+    SQL Server allows.
+    final_df has to be sorted by Country, Year, and Indicator, so any duplicates are next to each other and are
+    found by comparing each row's integer codes to the previous row's, which is much cheaper than failing partway
+    through the pivot or the upload
+    '''
+    indicators = get_used_categories(final_df["Indicator"])
+    n_indicators = len(indicators)
+    key_cols = [final_df["Country"].cat.codes.to_numpy(), final_df["Year"].to_numpy(), final_df["Indicator"].cat.codes.to_numpy()]
+    same_as_previous = np.ones(max(len(final_df) - 1, 0), dtype=bool)
+    for key_col in key_cols:
+        same_as_previous &= key_col[1:] == key_col[:-1]
+    if same_as_previous.any():
+        duplicates = final_df.iloc[np.flatnonzero(same_as_previous) + 1][["Country", "Year", "Indicator"]].drop_duplicates()
+        raise ValueError(f"{len(duplicates)} country, year, and indicator combinations have more than one value, "
+                         f"ex: {duplicates.head(5).astype(str).values.tolist()}")
+
+    if PIVOT_LAYOUT in ("table", "view"):
+        if n_indicators > PIVOT_MAX_COLUMNS:
+            raise ValueError(f"{n_indicators} indicators don't fit in one {PIVOT_LAYOUT} of at most {PIVOT_MAX_COLUMNS} "
+                             f"columns, set PIVOT_LAYOUT to \"groups\"")
+        long_names = [name for name in indicators if len(name) > 128]
+        if long_names:
+            raise ValueError(f"Indicator names are too long to be column names: {long_names}, "
+                             f"set PIVOT_LAYOUT to \"groups\"")
+
+
+def pivot_indicators(final_df, column_groups):
+    '''
+    Pivots final_df to one row per country and year with one column per indicator, one group of columns at a time.
+    column_groups is a list of lists of indicator names. For each group, yields a dataframe of the Country and Year
+    of every row followed by a column of values for each indicator in the group. Every group has the same rows.
+
+    The values are placed straight into an array by the position of their row and column, which avoids the
+    index building of DataFrame.pivot and keeps only one group of columns in memory at a time
+    '''
+    row_ids = final_df.groupby(["Country", "Year"], sort=True, observed=True).ngroup().to_numpy()
+    keys_df = final_df[["Country", "Year"]].drop_duplicates().sort_values(["Country", "Year"]).reset_index(drop=True)
+    indicator_codes = final_df["Indicator"].cat.codes.to_numpy()
+    values = final_df["Value"].to_numpy()
+    categories = final_df["Indicator"].cat.categories
+
+    for names in column_groups:
+        # Position of each indicator's column within the group, -1 for indicators that aren't in it
+        columns = np.full(len(categories), -1)
+        columns[categories.get_indexer(names)] = np.arange(len(names))
+        row_columns = columns[indicator_codes]
+        in_group = row_columns >= 0
+
+        group_values = np.full((len(keys_df), len(names)), np.nan, dtype=values.dtype)
+        group_values[row_ids[in_group], row_columns[in_group]] = values[in_group]
+        yield pd.concat([keys_df, pd.DataFrame(group_values, columns=names)], axis=1)
+
+
+def upload_pivoted_table(uploads, final_df):
+    '''
+    Uploads Final_Pivoted, with a column named after each indicator
+    '''
+    indicators = list(get_used_categories(final_df["Indicator"]))
+    with metrics.stage("pivot", rows_in=len(final_df)) as stage:
+        final_pivoted_df = next(pivot_indicators(final_df, [indicators]))
+        stage["rows_out"] = len(final_pivoted_df)
     final_pivoted_df_table_name = "Final_Pivoted"
 
     # First two columns are country and year, the rest are indicators with their values
@@ -257,68 +978,351 @@ def aggregate_and_upload_data(csv_paths, connection, cursor):
 
     for col in final_pivoted_df.columns[2:]:
         final_pivoted_df_schema.append(("\"" + col + "\"", "FLOAT"))
+    final_pivoted_df_indexes = [("UNIQUE CLUSTERED", ["Country", "Year"])]
+
+    uploads.upload(final_pivoted_df, final_pivoted_df_table_name, final_pivoted_df_schema,
+                   keys=["Country", "Year"], indexes=final_pivoted_df_indexes)
+
+
+def drop_pivoted_groups(uploads, keep=0):
+    '''
+    Queues the Final_Pivoted_N tables after the first keep groups on the UploadPool to be dropped, and Pivot_Columns
+    too if no groups are kept
+    '''
+    resp = uploads.cursor.execute("SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME LIKE 'Final[_]Pivoted[_]%';").fetchall()
+    for row in resp:
+        suffix = row[0][len("Final_Pivoted_"):]
+        if suffix.isdigit() and int(suffix) > keep:
+            uploads.drop(row[0])
+    if keep == 0:
+        uploads.drop("Pivot_Columns")
+
+
+def upload_pivoted_groups(uploads, final_df):
+    '''
+    Uploads the pivoted data split over Final_Pivoted_1, Final_Pivoted_2, ... with at most PIVOT_MAX_COLUMNS indicator
+    columns each, named by the indicator's id in Dim_Indicator, and the Pivot_Columns table listing the table and
+    column of each indicator. Indicators are grouped in id order, so new indicators only change the last table
+    '''
+    # The ids of the last run are read back from Pivot_Columns, or from Dim_Indicator when it's uploaded too
+    ids_table_name = "Dim_Indicator" if OUTPUT_SCHEMA in ("star", "both") else "Pivot_Columns"
+    indicators_dim_df = get_dimension(uploads.cursor, get_used_categories(final_df["Indicator"]),
+                                      ids_table_name, "IndicatorID", "Indicator")
+    column_groups = [indicators_dim_df.iloc[start:start + PIVOT_MAX_COLUMNS]
+                     for start in range(0, len(indicators_dim_df), PIVOT_MAX_COLUMNS)]
+
+    pivot_columns_dfs = []
+    for number, (group_dim_df, group_df) in enumerate(
+            zip(column_groups, pivot_indicators(final_df, [list(group["Indicator"]) for group in column_groups])), start=1):
+        table_name = f"Final_Pivoted_{number}"
+        column_names = [f"I{indicator_id}" for indicator_id in group_dim_df["IndicatorID"]]
+        group_df.columns = ["Country", "Year"] + column_names
+        schema = [("Country", "NCHAR(100)"), ("Year", "INT")] + [(col, "FLOAT") for col in column_names]
+        uploads.upload(group_df, table_name, schema,
+                       keys=["Country", "Year"], indexes=[("UNIQUE CLUSTERED", ["Country", "Year"])])
+        pivot_columns_dfs.append(pd.DataFrame({"Table_Name": table_name,
+                                               "Column_Name": column_names,
+                                               "IndicatorID": group_dim_df["IndicatorID"].to_numpy(),
+                                               "Indicator": group_dim_df["Indicator"].to_numpy()}))
+
+    # Removes the tables of groups left over from runs with more indicators, and the table or view of the other
+    # layouts, when the new tables are swapped in
+    drop_pivoted_groups(uploads, keep=len(column_groups))
+    uploads.drop("Final_Pivoted")
+
+    uploads.upload(pd.concat(pivot_columns_dfs, ignore_index=True), "Pivot_Columns",
+                   [("Table_Name", "NVARCHAR(128)"),
+                    ("Column_Name", "NVARCHAR(128)"),
+                    ("IndicatorID", "SMALLINT"),
+                    ("Indicator", "NVARCHAR(500)")],
+                   keys=["IndicatorID"])
+
+
+def create_pivoted_view(connection, cursor, final_df):
+    '''
+    Creates Final_Pivoted as a view that pivots the long table in the database, with a column named after each
+    indicator, so no wide table is built or uploaded. Reads Final, or Fact_Final if only the star schema is uploaded
+    '''
+    indicators = get_used_categories(final_df["Indicator"])
+    if OUTPUT_SCHEMA in ("flat", "both"):
+        # Quotes are doubled to escape them in the string literals and column names
+        conditions = ["Indicator = N'" + name.replace("'", "''") + "'" for name in indicators]
+        names = list(indicators)
+        select_keys = "Country, Year"
+        source = "Final"
+        group_by = "Country, Year"
+    else:
+        indicators_dim_df = get_dimension(cursor, indicators, "Dim_Indicator", "IndicatorID", "Indicator")
+        conditions = [f"f.IndicatorID = {indicator_id}" for indicator_id in indicators_dim_df["IndicatorID"]]
+        names = list(indicators_dim_df["Indicator"])
+        select_keys = "c.Country AS Country, f.Year AS Year"
+        source = "Fact_Final f JOIN Dim_Country c ON c.CountryID = f.CountryID"
+        group_by = "c.Country, f.Year"
+    value = "Value" if source == "Final" else "f.Value"
+    columns = [f'MAX(CASE WHEN {condition} THEN {value} END) AS "' + name.replace('"', '""') + '"'
+               for condition, name in zip(conditions, names)]
+
+    with metrics.stage("create_view Final_Pivoted"):
+        drop_table_or_view(cursor, "Final_Pivoted")
+        # CREATE VIEW has to be the only statement in its batch
+        cursor.execute(
+            f'''
+            CREATE OR ALTER VIEW Final_Pivoted AS
+            SELECT {select_keys}, {", ".join(columns)}
+            FROM {source}
+            GROUP BY {group_by};
+            ''')
+        connection.commit()
+
+
+def upload_star_schema(uploads, final_df, full_indicator_data_df):
+    '''
+    Uploads the indicator data as a star schema. The country and indicator names are only stored once in
+    Dim_Country and Dim_Indicator, and the fact tables refer to them by SMALLINT ids, which makes their rows
+    a few bytes wide instead of over a kilobyte of padded names
+    '''
+    countries_dim_df = get_dimension(uploads.cursor, full_indicator_data_df["Country"].cat.categories,
+                                     "Dim_Country", "CountryID", "Country")
+    indicators_dim_df = get_dimension(uploads.cursor, full_indicator_data_df["Indicator"].cat.categories,
+                                      "Dim_Indicator", "IndicatorID", "Indicator")
+    indicators_dim_df["Category"] = indicators_dim_df["Indicator"].map(INDICATOR_CATEGORY_INDEX).fillna("None")
+
+    uploads.upload(countries_dim_df, "Dim_Country",
+                   [("CountryID", "SMALLINT"), ("Country", "NVARCHAR(100)")],
+                   keys=["CountryID"],
+                   indexes=[("UNIQUE CLUSTERED", ["CountryID"])])
+    uploads.upload(indicators_dim_df, "Dim_Indicator",
+                   [("IndicatorID", "SMALLINT"), ("Indicator", "NVARCHAR(500)"), ("Category", "NVARCHAR(100)")],
+                   keys=["IndicatorID"],
+                   indexes=[("UNIQUE CLUSTERED", ["IndicatorID"])])
+
+    def get_fact_df(df, value_cols):
+        # Replaces the names of each row with their ids
+        fact_df = pd.DataFrame({"CountryID": get_dimension_keys(df["Country"], countries_dim_df, "CountryID", "Country"),
+                                "Year": df["Year"],
+                                "IndicatorID": get_dimension_keys(df["Indicator"], indicators_dim_df, "IndicatorID", "Indicator")})
+        for col in value_cols:
+            fact_df[col] = df[col]
+        return fact_df
+
+    uploads.upload(get_fact_df(final_df, ["Value"]), "Fact_Final",
+                   [("CountryID", "SMALLINT"),
+                    ("Year", "SMALLINT"),
+                    ("IndicatorID", "SMALLINT"),
+                    ("Value", "FLOAT")],
+                   keys=["CountryID", "Year", "IndicatorID"],
+                   indexes=[("CLUSTERED COLUMNSTORE", [])])
+    uploads.upload(get_fact_df(full_indicator_data_df, ["Value", "Difference", "Abs Diff", "Rank"]),
+                   "Fact_Indicator_Data",
+                   [("CountryID", "SMALLINT"),
+                    ("Year", "SMALLINT"),
+                    ("IndicatorID", "SMALLINT"),
+                    ("Value", "FLOAT"),
+                    ("Difference", "FLOAT"),
+                    ("\"Abs Diff\"", "FLOAT"),
+                    ("Rank", "FLOAT")],
+                   keys=["CountryID", "Year", "IndicatorID"],
+                   indexes=[("CLUSTERED COLUMNSTORE", [])])
+
+
+def upload_summary_tables(uploads, full_indicator_data_df):
+    '''
+    Uploads tables summarizing the full indicator data, so the dashboard reads a few thousand precomputed rows
+    instead of aggregating the whole table on every refresh:
+        Latest_Values: the most recent year of each country and indicator
+        Top_Movers: the TOP_MOVERS_N indicators with the largest absolute difference for each country and year
+        Category_Summary: the number of indicators, how many went up or down, and the mean and largest
+                          absolute difference of each category for each country and year
+    '''
+    df = full_indicator_data_df
+    with metrics.stage("summaries", rows_in=len(df)) as stage:
+        # The row holding the largest year of each country and indicator
+        latest_rows = df.groupby(["Country", "Indicator"], sort=False, observed=True)["Year"].idxmax()
+        latest_df = df.loc[latest_rows, ["Country", "Indicator", "Category", "Year", "Value", "Difference"]]
+        latest_df = latest_df.sort_values(["Country", "Indicator"]).reset_index(drop=True)
+
+        # Indicators that didn't change aren't movers
+        movers_df = df[df["Abs Diff"] > 0].sort_values(["Country", "Year", "Abs Diff"], ascending=[True, True, False])
+        movers_df = movers_df.groupby(["Country", "Year"], sort=False, observed=True).head(TOP_MOVERS_N)
+        movers_df = movers_df[["Country", "Year", "Indicator", "Category", "Value", "Difference", "Abs Diff"]]
+        movers_df.insert(2, "Position",
+                         movers_df.groupby(["Country", "Year"], sort=False, observed=True).cumcount() + 1)
+        movers_df = movers_df.reset_index(drop=True)
+
+        category_groups = df.assign(Increases=df["Difference"] > 0, Decreases=df["Difference"] < 0) \
+                            .groupby(["Country", "Year", "Category"], observed=True)
+        category_df = category_groups.agg(Indicators=("Indicator", "count"),
+                                          Increases=("Increases", "sum"),
+                                          Decreases=("Decreases", "sum"),
+                                          Mean_Abs_Diff=("Abs Diff", "mean"),
+                                          Max_Abs_Diff=("Abs Diff", "max")).reset_index()
+        stage["rows_out"] = len(latest_df) + len(movers_df) + len(category_df)
+
+    uploads.upload(latest_df, "Latest_Values",
+                   [("Country", "NVARCHAR(100)"),
+                    ("Indicator", "NVARCHAR(500)"),
+                    ("Category", "NVARCHAR(100)"),
+                    ("Year", "INT"),
+                    ("Value", "FLOAT"),
+                    ("Difference", "FLOAT")],
+                   keys=["Country", "Indicator"],
+                   indexes=[("CLUSTERED", ["Country"])])
+    uploads.upload(movers_df, "Top_Movers",
+                   [("Country", "NVARCHAR(100)"),
+                    ("Year", "INT"),
+                    ("Position", "INT"),
+                    ("Indicator", "NVARCHAR(500)"),
+                    ("Category", "NVARCHAR(100)"),
+                    ("Value", "FLOAT"),
+                    ("Difference", "FLOAT"),
+                    ("\"Abs Diff\"", "FLOAT")],
+                   keys=["Country", "Year", "Position"],
+                   indexes=[("UNIQUE CLUSTERED", ["Country", "Year", "Position"])])
+    uploads.upload(category_df, "Category_Summary",
+                   [("Country", "NVARCHAR(100)"),
+                    ("Year", "INT"),
+                    ("Category", "NVARCHAR(100)"),
+                    ("Indicators", "INT"),
+                    ("Increases", "INT"),
+                    ("Decreases", "INT"),
+                    ("Mean_Abs_Diff", "FLOAT"),
+                    ("Max_Abs_Diff", "FLOAT")],
+                   keys=["Country", "Year", "Category"],
+                   indexes=[("UNIQUE CLUSTERED", ["Country", "Year", "Category"])])
+
+
+def aggregate_and_upload_data(source_dfs, connection, cursor, connect=None):
+    '''
+    Combines the dataframes of each source into one dataframe, and then uploads data to datbase
+    in different formats. Runs the Final, Full_Indicator_Data, and upload stages one after another
+    '''
+    final_df = combine_sources(source_dfs)
+    full_indicator_data_df = compute_indicator_data(final_df)
+    upload_indicator_tables(final_df, full_indicator_data_df, connection, cursor, connect)
+
+
+def combine_sources(source_dfs):
+    '''
+    Joins the dataframes of each source into the Final table, sorted by country, year, and indicator.
+    Raises a ValueError if it can't be pivoted (see check_pivot)
+    '''
+    ### Joins the data into "Final" table
+    final_df_cols = ["Country", "Year", "Indicator", "Value"]
+    with metrics.stage("combine", rows_in=sum(len(source_df) for source_df in source_dfs)) as stage:
+        final_df = concat_source_dfs(apply_source_schema(source_df[final_df_cols]) for source_df in source_dfs)
+
+        final_df = final_df.sort_values(["Country", "Year", "Indicator"])
+        final_df = final_df.reset_index(drop=True)
+        stage["rows_out"] = len(final_df)
+
+    # Fails before anything is uploaded if the data can't be pivoted
+    check_pivot(final_df)
+    return final_df
 
-    upload_table(connection, cursor, final_pivoted_df, final_pivoted_df_table_name, final_pivoted_df_schema)
 
+def compute_indicator_data(final_df):
+    '''
+    Returns the Full_Indicator_Data table: each value of final_df with its relative difference from the previous
+    year, the rank of that difference among the indicators of the same year, and the indicator's category
+    '''
     ### Calculates the relative difference for each value across consecutive years.
     
-    relative_df = final_df.sort_values(["Country", "Indicator", "Year"]).reset_index(drop=True)
-
-    previous_country = ""
-    previous_indicator = ""
-    relative_values = []
-
-    for index, row in relative_df.iterrows():
-        current_country = row["Country"]
-        current_indicator = row["Indicator"]
-        current_value = row["Value"]
-        if previous_country != current_country or previous_indicator != current_indicator:
-            # New indicator or country row
-            relative_values.append(0)
-        else:
-            # Same indicator and country
-            relative_values.append(rel_diff(previous_value, current_value))
-        previous_country = current_country
-        previous_indicator = current_indicator
-        previous_value = current_value
+    with metrics.stage("difference", rows_in=len(final_df)) as stage:
+        relative_df = final_df.sort_values(["Country", "Indicator", "Year"]).reset_index(drop=True)
+
+        # Calculates the "relative percent difference" between each value and the previous year's value of the same
+        # country and indicator, as explained here:
+        # https://stats.stackexchange.com/questions/86708/how-to-calculate-relative-error-when-the-true-value-is-zero
+        # The first year of each country and indicator has a difference of 0, as does any pair where either value is 0
+        current_values = relative_df["Value"].astype("float64")
+        country_indicator_groups = current_values.groupby([relative_df["Country"], relative_df["Indicator"]],
+                                                          sort=False, observed=True)
+        previous_values = country_indicator_groups.shift()
+
+        relative_values = 2 * ((current_values - previous_values) / (previous_values.abs() + current_values.abs()))
+        relative_values[(previous_values == 0) | (current_values == 0)] = 0
+        relative_values[country_indicator_groups.cumcount() == 0] = 0
 
-    relative_df['Difference'] = relative_values
+        relative_df['Difference'] = relative_values.astype(VALUE_DTYPE)
+        stage["rows_out"] = len(relative_df)
 
     
     ### Calculates the magnitude of change for each value and then ranks indicators based on magnitude of change per year
-    relative_df["Abs Diff"] = abs(relative_df["Difference"])
-    relative_df = relative_df.sort_values(["Indicator", "Year", "Abs Diff"], ascending=[True, True, False]).reset_index(drop=True)
-    
-    total_rankings = []
-    indicator_values = []
-    previous_indicator = ""
-    previous_year = 0
-    for index, row in relative_df.iterrows():
-        current_indicator = row["Indicator"]
-        current_year = row["Year"]
-        current_value = row["Abs Diff"]
-        if current_indicator != previous_indicator or current_year != previous_year:
-            # figure out ranking here
-            indicator_rankings = pd.Series(indicator_values, dtype="float64").rank().tolist()
-            total_rankings.extend(check_rankings(indicator_rankings))
-            indicator_values = [current_value]
-        else:
-            indicator_values.append(current_value)
-        previous_indicator = current_indicator
-        previous_year = current_year
-    indicator_rankings = pd.Series(indicator_values, dtype="float64").rank().tolist()
-    total_rankings.extend(check_rankings(indicator_rankings))
-    relative_df["Rank"] = total_rankings
+    with metrics.stage("rank", rows_in=len(relative_df)) as stage:
+        relative_df["Abs Diff"] = abs(relative_df["Difference"])
+        relative_df = relative_df.sort_values(["Indicator", "Year", "Abs Diff"], ascending=[True, True, False]).reset_index(drop=True)
+
+        abs_diffs = relative_df["Abs Diff"].astype("float64")
+        indicator_year_groups = abs_diffs.groupby([relative_df["Indicator"], relative_df["Year"]], sort=False, observed=True)
+        rankings = indicator_year_groups.rank()
+
+        # If all rankings in an (indicator, year) are the same, then the relative ranking is not useful and we don't want
+        # this to skew the results when searching for the most impactful indicators.
+        # ex: Since we are measuring relative differences, the first indicator's year will always be made up of the same values.
+        # If all rankings are the same (all values are equal and none are missing), then all rankings will become 1
+        all_same = ((indicator_year_groups.transform("min") == indicator_year_groups.transform("max"))
+                    & (indicator_year_groups.transform("count") == indicator_year_groups.transform("size")))
+        rankings[all_same] = 1
+        relative_df["Rank"] = rankings
+        stage["rows_out"] = len(relative_df)
     
     
     ### Adds a categorical variable to each value. Here, the category is the source
-    categories = []
-    for index, row in relative_df.iterrows():
-        indicator = row["Indicator"]
-        categories.append(get_indicator_category(indicator))
+    categories = relative_df["Indicator"].map(INDICATOR_CATEGORY_INDEX).astype(object)
+
+    # Indicators missing from INDICATOR_CATEGORIES are reported once instead of once per row
+    unknown_indicators = relative_df["Indicator"][categories.isna()].unique()
+    if len(unknown_indicators) > 0:
+        print(f"No category for {len(unknown_indicators)} indicators: {sorted(unknown_indicators)}")
+    categories = categories.fillna("None")
 
     full_indicator_data_df = relative_df
     full_indicator_data_df["Category"] = categories
+    return full_indicator_data_df
+
+
+def upload_indicator_tables(final_df, full_indicator_data_df, connection, cursor, connect=None, uploaded=None):
+    '''
+    Uploads final_df and full_indicator_data_df in different formats, with the tables built from them.
+    Tables are uploaded in the background while the next ones are built, over UPLOAD_CONNECTIONS connections
+    opened with connect (one at a time over connection without it), and replace the dashboard's tables all
+    at once at the end. uploaded skips the tables that haven't changed, see UploadPool
+    '''
+    uploads = UploadPool(connection, cursor, connect, uploaded=uploaded)
+    try:
+        upload_all_tables(final_df, full_indicator_data_df, uploads)
+    finally:
+        uploads.close()
+    print("Uploads complete")
+
+
+def upload_all_tables(final_df, full_indicator_data_df, uploads):
+    '''
+    Builds every table from final_df and full_indicator_data_df and queues it on the UploadPool
+    '''
+    ### Uploads the data into "Final" table
+    final_df_table_name = "Final"
+    final_df_schema = [("Country", "NCHAR(100)"),
+                       ("Year", "INT"),
+                       ("Indicator", "NCHAR(500)"),
+                       ("Value", "FLOAT")]
+    # The dashboard scans and aggregates this table, which a columnstore index compresses and speeds up
+    final_df_indexes = [("CLUSTERED COLUMNSTORE", [])]
+
+    if OUTPUT_SCHEMA in ("flat", "both"):
+        uploads.upload(final_df, final_df_table_name, final_df_schema,
+                       keys=["Country", "Year", "Indicator"], indexes=final_df_indexes)
+
+    ### Pivots then uploads the data in "Final_Pivoted" table, or in groups of columns, see PIVOT_LAYOUT
+    ### The tables of the other layouts, left over from runs with a different PIVOT_LAYOUT, are dropped at the swap
+    if PIVOT_LAYOUT == "table":
+        upload_pivoted_table(uploads, final_df)
+        drop_pivoted_groups(uploads)
+    elif PIVOT_LAYOUT == "groups":
+        upload_pivoted_groups(uploads, final_df)
+    else:
+        # The view replaces Final_Pivoted itself once it's created
+        drop_pivoted_groups(uploads)
 
     full_indicator_data_df_table_name = "Full_Indicator_Data"
     full_indicator_data_df_schema = [("Country", "NCHAR(100)"),
@@ -329,8 +1333,18 @@ def aggregate_and_upload_data(csv_paths, connection, cursor):
                                      ("\"Abs Diff\"", "FLOAT"),
                                      ("Rank", "FLOAT"),
                                      ("Category", "NCHAR(100)")]
+    full_indicator_data_df_indexes = [("CLUSTERED COLUMNSTORE", [])]
+
+    if OUTPUT_SCHEMA in ("flat", "both"):
+        uploads.upload(full_indicator_data_df, full_indicator_data_df_table_name, full_indicator_data_df_schema,
+                       keys=["Country", "Year", "Indicator"], indexes=full_indicator_data_df_indexes)
 
-    upload_table(connection, cursor, full_indicator_data_df, full_indicator_data_df_table_name, full_indicator_data_df_schema)
+    ### Uploads the same data as dimension and fact tables
+    if OUTPUT_SCHEMA in ("star", "both"):
+        upload_star_schema(uploads, final_df, full_indicator_data_df)
+
+    ### Uploads small summary tables for the dashboard's overview pages
+    upload_summary_tables(uploads, full_indicator_data_df)
     
     ### Creates a table of external links for indicators that are missing data
     ### These are all the sources that are not yet included in the database, but are relevant to measuring
@@ -360,15 +1374,1093 @@ def aggregate_and_upload_data(csv_paths, connection, cursor):
     external_df_schema = [("Source", "NCHAR(500)"),
                           ("URL", "NCHAR(500)")]
 
-    upload_table(connection, cursor, external_df, external_df_table_name, external_df_schema)
-    print("Uploads complete")
+    uploads.upload(external_df, external_df_table_name, external_df_schema)
+
+    # Swaps every table in once they are all loaded
+    uploads.swap()
+
+    # The view reads the uploaded long table, so it's created last
+    if PIVOT_LAYOUT == "view":
+        create_pivoted_view(uploads.connection, uploads.cursor, final_df)
+
+
+def get_peak_rss():
+    '''
+    Returns the most memory (bytes) this process has held at once so far, or None where it can't be measured
+    '''
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+class RunMetrics:
+    '''
+    Metrics of every stage of a run
+
+    Each stage records its wall time, the bytes downloaded and rows read while it was running, the rows it produced,
+    and the peak memory of the process when it finished. Stages can be nested, bytes and rows added while a stage
+    is running are counted by every stage that is open, so "FAO" includes the downloads of all its sources
+    (and stages of a Pipeline that run at the same time count each other's downloads too).
+    Worker processes record their own stages, which are sent back with their results and added with addStages()
+    '''
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = []
+        self.open_stages = []
+        self.lock = threading.Lock() # bytes are counted from the worker threads that download them
+
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        '''
+        Times the code run inside the with block as a stage called name. Yields the stage's dict so the code
+        can fill in rows_in and rows_out itself
+        '''
+        stage = {"stage": name,
+                 "pid": os.getpid(),
+                 "seconds": None,
+                 "bytes_downloaded": 0,
+                 "rows_in": rows_in,
+                 "rows_out": None,
+                 "peak_rss_bytes": None}
+        with self.lock:
+            self.open_stages.append(stage)
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage["seconds"] = time.perf_counter() - start
+            stage["peak_rss_bytes"] = get_peak_rss()
+            with self.lock:
+                self.open_stages.remove(stage)
+                self.stages.append(stage)
+
+
+    def add(self, key, amount):
+        # Adds to a counter ("bytes_downloaded" or "rows_in") of every stage that is currently open
+        with self.lock:
+            for stage in self.open_stages:
+                stage[key] = (stage[key] or 0) + amount
+
+
+    def addStages(self, stages):
+        '''
+        Adds the stages recorded by a worker process, counting their bytes and rows in the stages open here
+        '''
+        for stage in stages:
+            self.add("bytes_downloaded", stage["bytes_downloaded"])
+            if stage["rows_in"] is not None:
+                self.add("rows_in", stage["rows_in"])
+        with self.lock:
+            self.stages.extend(stages)
+
+
+    def writeReport(self, path, succeeded):
+        '''
+        Writes the run and all of its stages to path as json
+        '''
+        if path is None:
+            return
+        finished = time.time()
+        report = {"started": datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+                  "finished": datetime.fromtimestamp(finished, timezone.utc).isoformat(),
+                  "seconds": finished - self.started,
+                  "succeeded": succeeded,
+                  "peak_rss_bytes": get_peak_rss(),
+                  "stages": self.stages}
+        self.writeFile(path, json.dumps(report, indent=2))
+
+
+    def writePrometheus(self, path, succeeded):
+        '''
+        Writes the metrics of the run to path in the Prometheus text format, one series per stage
+        '''
+        if path is None:
+            return
+        metric_help = [("seconds", "Wall time of the stage in seconds"),
+                       ("bytes_downloaded", "Bytes downloaded while the stage was running"),
+                       ("rows_in", "Rows read by the stage"),
+                       ("rows_out", "Rows produced by the stage"),
+                       ("peak_rss_bytes", "Peak resident memory of the process running the stage")]
+        lines = ["# HELP dashboard_run_succeeded Whether the last run finished without an error",
+                 "# TYPE dashboard_run_succeeded gauge",
+                 f"dashboard_run_succeeded {int(succeeded)}",
+                 "# HELP dashboard_run_timestamp_seconds When the last run finished",
+                 "# TYPE dashboard_run_timestamp_seconds gauge",
+                 f"dashboard_run_timestamp_seconds {time.time():.0f}"]
+        for key, help_text in metric_help:
+            lines.append(f"# HELP dashboard_stage_{key} {help_text}")
+            lines.append(f"# TYPE dashboard_stage_{key} gauge")
+            # A stage that ran more than once is summed, except for peak memory which is the highest
+            values = {}
+            for stage in self.stages:
+                if stage[key] is None:
+                    continue
+                if key == "peak_rss_bytes":
+                    values[stage["stage"]] = max(values.get(stage["stage"], 0), stage[key])
+                else:
+                    values[stage["stage"]] = values.get(stage["stage"], 0) + stage[key]
+            for name, value in values.items():
+                label = name.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                lines.append(f'dashboard_stage_{key}{{stage="{label}"}} {value}')
+        self.writeFile(path, "\n".join(lines) + "\n")
+
+
+    def writeFile(self, path, text):
+        # Writes to a temporary file first so a collector never reads a partial file
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(handle, "w") as temp_file:
+            temp_file.write(text)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+
+
+# Metrics of the current run, worker processes replace it with their own
+metrics = RunMetrics()
+
+
+class Pipeline:
+    '''
+    Stages of a run, each one a function of the outputs of the stages it depends on
+
+    Stages that don't depend on each other run at the same time, each in a thread of its own.
+    The output of each stage is saved to checkpoint_dir as a pickle file, which keeps the exact column types
+    (categoricals included) without needing pyarrow, and manifest.json records the fingerprint it was made from:
+    a hash of the stage's name, its settings, and the content of its inputs. A run reuses every output saved since
+    the last run that succeeded, by a failed run or by running some of the stages on their own (ex: fetch), whose
+    fingerprint still matches and that is younger than max_age. So it resumes from the stages that failed, or from
+    the first stages whose settings or inputs changed. Outputs saved before the last successful run are not reused,
+    checkpoints are only there to resume from, and running some of the stages on their own needs the checkpoints of
+    their other inputs to be current in the same way.
+    Outputs that are None (ex: the upload's) aren't saved, those stages run every time they are reached
+    '''
+
+    def __init__(self, checkpoint_dir, max_age):
+        self.checkpoint_dir = checkpoint_dir
+        self.max_age = max_age
+        self.stages = {}
+        self.hooks = []
+        self.lock = threading.Lock() # the stages running at the same time share the manifest and outputs
+
+
+    def add(self, name, function, inputs=(), settings=None):
+        '''
+        Adds a stage called name that calls function with the outputs of the stages named in inputs, which have to
+        be added first. settings returns the values, besides the inputs, that the output depends on.
+        A stage without inputs is a source
+        '''
+        for input_name in inputs:
+            if input_name not in self.stages:
+                raise ValueError(f"Stage {name} depends on {input_name}, which has to be added before it")
+        self.stages[name] = {"function": function,
+                             "inputs": list(inputs),
+                             "settings": settings if settings is not None else (lambda: [])}
+
+
+    def addHooks(self, start, close):
+        '''
+        Calls start with the names of the stages that may run before a run starts any of them,
+        and close once they have all finished
+        '''
+        self.hooks.append((start, close))
+
+
+    def names(self):
+        return list(self.stages)
+
+
+    def sources(self):
+        return [name for name, stage in self.stages.items() if not stage["inputs"]]
+
+
+    def selectSources(self, selectors):
+        '''
+        Returns the names of the sources matching any of the selectors, in order. A selector is the name of a source
+        or of a group of sources, case insensitive, ex: "fao.source2", "fao" for every FAO source, or "worldbank".
+        Raises a ValueError for a selector that matches no source
+        '''
+        selected = set()
+        for selector in selectors:
+            matches = [name for name in self.sources()
+                       if name.lower() == selector.lower() or name.lower().startswith(selector.lower() + ".")]
+            if not matches:
+                raise ValueError(f"unknown source {selector}, the sources are {self.sources()}")
+            selected.update(matches)
+        return [name for name in self.sources() if name in selected]
+
+
+    def downstream(self, names):
+        '''
+        Returns the stages in names along with every stage that depends on them, in order
+        '''
+        selected = set(names)
+        for name, stage in self.stages.items():
+            if any(input_name in selected for input_name in stage["inputs"]):
+                selected.add(name)
+        return [name for name in self.stages if name in selected]
+
+
+    def run(self, names=None, fresh=False):
+        '''
+        Runs every stage, reusing the checkpoints saved since the last successful run that are still current,
+        unless fresh is True. If names is given, only those stages are run, all of them, on the checkpointed outputs
+        of the inputs they don't run themselves, which have to be current. Raises a RuntimeError if one isn't
+        '''
+        if self.checkpoint_dir is not None:
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+        manifest = self.readManifest()
+        resume = names is None
+        if resume:
+            last_success = manifest.get("last_success")
+            if fresh:
+                manifest["stages"] = {}
+            elif last_success is not None:
+                manifest["stages"] = {name: entry for name, entry in manifest["stages"].items()
+                                      if entry["finished"] > last_success}
+            manifest["last_success"] = None
+            names = self.names()
+        else:
+            for name in names:
+                for input_name in self.stages[name]["inputs"]:
+                    if input_name not in names and not self.isCurrent(manifest, input_name):
+                        raise RuntimeError(f"The {name} stage needs a current checkpoint of the {input_name} stage, "
+                                           f"one made with the same settings and inputs in the last "
+                                           f"{self.max_age} seconds, so it has to be run first")
+
+        started = []
+        try:
+            for start, close in self.hooks:
+                start(names)
+                started.append(close)
+            self.runStages(manifest, names, resume)
+        finally:
+            for close in reversed(started):
+                close()
+        if resume:
+            manifest["last_success"] = time.time()
+            self.writeManifest(manifest)
+
+
+    def runStages(self, manifest, names, resume):
+        # Starts each stage as soon as the stages it depends on are done. Stages that aren't in names are done
+        # already, and when resuming so is any stage whose checkpoint is current. After a failure no more stages
+        # are started, the ones already running are waited for, so their outputs are saved, and the first error
+        # is raised
+        done = set(name for name in self.stages if name not in names)
+        waiting = list(names)
+        outputs = {}
+        errors = []
+        with ThreadPoolExecutor(max_workers=max(len(names), 1)) as executor:
+            running = {}
+            while True:
+                ready = [name for name in waiting if all(input_name in done for input_name in self.stages[name]["inputs"])]
+                if errors:
+                    ready = []
+                for name in ready:
+                    waiting.remove(name)
+                    with self.lock:
+                        current = resume and self.isCurrent(manifest, name)
+                    if current:
+                        finished = datetime.fromtimestamp(manifest["stages"][name]["finished"]).isoformat(timespec="seconds")
+                        print(f"Reusing the {name} checkpoint from {finished}")
+                        done.add(name)
+                    else:
+                        running[executor.submit(self.runStage, manifest, name, outputs)] = name
+                if ready and not running:
+                    # Reused checkpoints may have made more stages ready
+                    continue
+                if not running:
+                    break
+                finished_futures, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished_futures:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                        done.add(name)
+                    except Exception as error:
+                        errors.append(error)
+        if errors:
+            raise errors[0]
+
+
+    def runStage(self, manifest, name, outputs):
+        # Runs a stage on its inputs, loading the ones that weren't run from their checkpoints,
+        # and saves its output and fingerprint
+        stage = self.stages[name]
+        for input_name in stage["inputs"]:
+            with self.lock:
+                if input_name not in outputs:
+                    outputs[input_name] = pd.read_pickle(self.checkpointPath(manifest, input_name))
+        with metrics.stage(name) as stage_metrics:
+            output = stage["function"](*[outputs[input_name] for input_name in stage["inputs"]])
+            if output is not None:
+                stage_metrics["rows_out"] = len(output)
+        sha256 = None
+        if output is not None and self.checkpoint_dir is not None:
+            sha256 = self.saveCheckpoint(name, output)
+
+        with self.lock:
+            outputs[name] = output
+            if self.checkpoint_dir is None:
+                return
+            manifest["stages"][name] = {"fingerprint": self.fingerprint(manifest, name),
+                                        "sha256": sha256,
+                                        "finished": time.time()}
+            self.writeManifest(manifest)
+
+
+    def isCurrent(self, manifest, name):
+        '''
+        Whether the stage's checkpoint can be reused: it was made from the same settings and inputs,
+        it isn't older than max_age, and its file is intact
+        '''
+        entry = manifest["stages"].get(name)
+        if entry is None or entry["sha256"] is None or time.time() - entry["finished"] >= self.max_age:
+            return False
+        if any(input_name not in manifest["stages"] for input_name in self.stages[name]["inputs"]):
+            return False
+        if entry["fingerprint"] != self.fingerprint(manifest, name):
+            return False
+        return self.checkpointPath(manifest, name) is not None
+
+
+    def fingerprint(self, manifest, name):
+        # Hash of everything the stage's output depends on, its inputs are identified by the hash of their content
+        stage = self.stages[name]
+        fingerprint = {"stage": name,
+                       "settings": stage["settings"](),
+                       "inputs": {input_name: manifest["stages"][input_name]["sha256"]
+                                  for input_name in stage["inputs"]}}
+        return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode()).hexdigest()
+
+
+    def checkpointPath(self, manifest, name):
+        '''
+        Returns the path of the stage's checkpoint, or None if there isn't one or it doesn't match its recorded hash
+        '''
+        entry = manifest["stages"].get(name)
+        if entry is None or entry["sha256"] is None:
+            return None
+        path = os.path.join(self.checkpoint_dir, name + ".pkl")
+        try:
+            if file_sha256(path) != entry["sha256"]:
+                return None
+        except FileNotFoundError:
+            return None
+        return path
+
+
+    def saveCheckpoint(self, name, output):
+        # Writes to a temporary file first so a failure while saving never leaves a partial checkpoint.
+        # Returns the sha256 of the file
+        handle, temp_path = tempfile.mkstemp(dir=self.checkpoint_dir, suffix=".tmp")
+        os.close(handle)
+        try:
+            output.to_pickle(temp_path)
+            sha256 = file_sha256(temp_path)
+            os.replace(temp_path, os.path.join(self.checkpoint_dir, name + ".pkl"))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return sha256
+
+
+    def readManifest(self):
+        # A missing or unreadable manifest is the same as having no checkpoints
+        empty = {"last_success": None, "stages": {}}
+        if self.checkpoint_dir is None:
+            return empty
+        try:
+            with open(os.path.join(self.checkpoint_dir, "manifest.json")) as manifest_file:
+                return json.load(manifest_file)
+        except (OSError, ValueError):
+            return empty
+
+
+    def writeManifest(self, manifest):
+        if self.checkpoint_dir is None:
+            return
+        handle, temp_path = tempfile.mkstemp(dir=self.checkpoint_dir, suffix=".tmp")
+        with os.fdopen(handle, "w") as temp_file:
+            json.dump(manifest, temp_file, indent=2)
+        os.replace(temp_path, os.path.join(self.checkpoint_dir, "manifest.json"))
+
+
+def file_sha256(path):
+    '''
+    Returns the sha256 of the file's content
+    '''
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def make_worker_pool():
+    '''
+    Returns a pool of FAO.max_workers processes to run the FAO sources in, each one started with the settings of
+    this process. With the spawn and forkserver start methods (the default on Windows, and on Linux from Python 3.14)
+    the workers import this file again, which would otherwise leave out the config file, the environment overrides,
+    and any setting changed since
+    '''
+    return multiprocessing.Pool(processes=FAO.max_workers, initializer=apply_settings, initargs=(get_settings(),))
+
+
+class FAOSourceRunner:
+    '''
+    Runs the FAO sources as separate stages of a pipeline. Every source runs in the same pool of FAO.max_workers
+    worker processes, so sources running at the same time still share FAO.max_workers cpus between them.
+    The pool is started before any stage, since forking worker processes while other threads are running
+    can leave a lock they hold locked forever in the workers
+    '''
+
+    def __init__(self):
+        self.fao = None
+        self.pool = None
+
+
+    def start(self, names):
+        if any(name.startswith("FAO.source") for name in names):
+            self.fao = FAO(fetch=False)
+            self.pool = make_worker_pool()
+
+
+    def run(self, number):
+        '''
+        Returns the dataframe of FAO source number, all of its regions combined in global mode
+        '''
+        tasks = [task for task in self.fao.getTasks() if task[0] == number]
+        return concat_source_dfs(self.fao.runTasks(self.pool, tasks))
+
+
+    def combine(self, source_dfs, parquet_path=None):
+        '''
+        Returns the dataframes of every FAO source combined into one, also saved to parquet_path if one is given
+        '''
+        fao = FAO(fetch=False)
+        df = fao.combineSources(source_dfs)
+        save_parquet(df, parquet_path)
+        return df
+
+
+    def close(self):
+        # Also stops any source that is still running after a failure or timeout
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+
+class Daemon:
+    '''
+    Keeps the database up to date by refreshing every source on its own interval, see DAEMON_REFRESH_INTERVALS
+
+    Each World Bank indicator and each FAO source is a source of its own. The World Bank session, the pool of FAO
+    worker processes, the download caches, and the database connections (the upload pool's too) stay open between
+    refreshes, and are only opened again after something failed on them. The tables are
+    only rebuilt after a refresh that changed the data of a source, and only the tables whose content changed are
+    uploaded again. A refresh or upload that fails is retried after retry_interval seconds, every other source
+    keeps its own schedule
+    '''
+
+    # Refresh interval (seconds) of the sources whose class has none in intervals, ex: a config that only sets
+    # {"FAO.source2": 3600} replaces the "WorldBank" and "FAO" defaults of DAEMON_REFRESH_INTERVALS
+    default_interval = 24 * 60 * 60
+
+    def __init__(self, intervals, retry_interval):
+        self.intervals = intervals
+        self.retry_interval = retry_interval
+        self.world_bank = WorldBank(fetch=False)
+        self.fao = FAO(fetch=False)
+        self.session = None
+        self.pool = None
+        self.connection = None
+        self.cursor = None
+        self.uploads = None
+        self.uploaded = {} # table name -> content hash, see UploadPool
+        self.rebuild_due = None # when the tables are rebuilt next, None while they are up to date
+
+        # Every source starts out due, so the first refresh fetches everything
+        self.sources = {}
+        for code in WorldBank.codes:
+            self.sources[f"WorldBank.{code}"] = {"code": code, "df": None, "hash": None, "due": 0}
+        for number in range(1, 7):
+            tasks = [task for task in self.fao.getTasks() if task[0] == number]
+            self.sources[f"FAO.source{number}"] = {"tasks": tasks, "df": None, "hash": None, "due": 0}
+
+
+    def getInterval(self, name):
+        # The source's own interval, or the one of all the sources of its class
+        if name in self.intervals:
+            return self.intervals[name]
+        return self.intervals.get(name.split(".")[0], Daemon.default_interval)
+
+
+    def run(self):
+        '''
+        Refreshes the sources as they come due, until the process is stopped
+        '''
+        try:
+            while True:
+                wait_seconds = self.refresh()
+                print(f"Next refresh in {wait_seconds:.0f} seconds")
+                time.sleep(wait_seconds)
+        finally:
+            self.close()
+
+
+    def refresh(self):
+        '''
+        Refreshes the sources that are due and rebuilds the tables if any of them changed, writing a run report
+        of just this refresh. Returns the number of seconds until the next source is due
+        '''
+        global metrics
+        metrics = RunMetrics()
+        succeeded = False
+        try:
+            now = time.time()
+            due = [name for name, source in self.sources.items() if source["due"] <= now]
+            succeeded = self.refreshWorldBank([name for name in due if name.startswith("WorldBank.")])
+            succeeded = self.refreshFAO([name for name in due if name.startswith("FAO.")]) and succeeded
+            # Both refreshes are done downloading, so nothing is reading the files eviction removes
+            evict_download_cache()
+            if self.rebuild_due is not None and self.rebuild_due <= time.time():
+                succeeded = self.rebuild() and succeeded
+        finally:
+            metrics.writeReport(RUN_REPORT_PATH, succeeded)
+            metrics.writePrometheus(METRICS_TEXTFILE_PATH, succeeded)
+
+        next_due = min(source["due"] for source in self.sources.values())
+        if self.rebuild_due is not None:
+            next_due = min(next_due, self.rebuild_due)
+        return max(0, next_due - time.time())
+
+
+    def refreshWorldBank(self, names):
+        # Fetches the due World Bank indicators together over the daemon's session. Returns False if it failed
+        if not names:
+            return True
+        if self.session is None:
+            self.session = self.world_bank.makeSession()
+        try:
+            with metrics.stage("WorldBank") as stage:
+                indicator_dfs = self.world_bank.fetchIndicators([self.sources[name]["code"] for name in names],
+                                                                self.session)
+                stage["rows_out"] = sum(len(indicator_df) for indicator_df in indicator_dfs.values())
+        except Exception as error:
+            self.fail(names, error)
+            # A new session is started in case the connections are what failed
+            self.session.close()
+            self.session = None
+            return False
+        for name in names:
+            self.update(name, indicator_dfs[self.sources[name]["code"]])
+        return True
+
+
+    def refreshFAO(self, names):
+        # Runs the due FAO sources together in the daemon's worker processes. Returns False if any of them failed
+        if not names:
+            return True
+        if self.pool is None:
+            self.pool = make_worker_pool()
+        tasks = [task for name in names for task in self.sources[name]["tasks"]]
+        errors = {}
+        with metrics.stage("FAO") as stage:
+            task_dfs = dict(zip(tasks, self.fao.runTasks(self.pool, tasks, errors)))
+            stage["rows_out"] = sum(len(task_df) for task_df in task_dfs.values() if task_df is not None)
+        if any(isinstance(error, TimeoutError) for error in errors.values()):
+            # Stops the sources that are still running, the next refresh starts new workers
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+        for name in names:
+            source_tasks = self.sources[name]["tasks"]
+            source_errors = [errors[task] for task in source_tasks if task in errors]
+            if source_errors:
+                self.fail([name], source_errors[0])
+            else:
+                self.update(name, concat_source_dfs(task_dfs[task] for task in source_tasks))
+        return not errors
+
+
+    def update(self, name, df):
+        # Schedules the source's next refresh and keeps its new data, the tables are rebuilt if it changed
+        source = self.sources[name]
+        source["due"] = time.time() + self.getInterval(name)
+        content_hash = hash_dataframe(df)
+        if content_hash != source["hash"]:
+            print(f"{name} has new data")
+            source["df"] = df
+            source["hash"] = content_hash
+            self.rebuild_due = time.time()
+
+
+    def fail(self, names, error):
+        print(f"Refreshing {', '.join(names)} failed, retrying in {self.retry_interval} seconds: {error!r}")
+        for name in names:
+            self.sources[name]["due"] = time.time() + self.retry_interval
+
+
+    def rebuild(self):
+        '''
+        Rebuilds the tables from the latest data of every source and uploads the ones that changed.
+        Returns False if it failed, it's then tried again after retry_interval seconds
+        '''
+        missing = [name for name, source in self.sources.items() if source["df"] is None]
+        if missing:
+            # Rebuilt as soon as the last of them has data, since that counts as a change
+            print(f"The tables are built once every source has been fetched, still missing: {missing}")
+            self.rebuild_due = None
+            return True
+        try:
+            wb_df = concat_source_dfs(self.sources[f"WorldBank.{code}"]["df"] for code in WorldBank.codes)
+            fao_df = self.fao.combineSources([self.sources[f"FAO.source{number}"]["df"] for number in range(1, 7)])
+            with metrics.stage("Final") as stage:
+                final_df = combine_sources([wb_df, fao_df])
+                stage["rows_out"] = len(final_df)
+            with metrics.stage("Full_Indicator_Data") as stage:
+                full_indicator_data_df = compute_indicator_data(final_df)
+                stage["rows_out"] = len(full_indicator_data_df)
+            with metrics.stage("upload"):
+                if self.connection is None:
+                    print("Connecting to database...")
+                    self.connection = connect_to_db()
+                    self.cursor = self.connection.cursor()
+                    self.cursor.fast_executemany = True
+                    self.uploads = UploadPool(self.connection, self.cursor, open_db_connection, uploaded=self.uploaded)
+                upload_all_tables(final_df, full_indicator_data_df, self.uploads)
+                print("Uploads complete")
+        except Exception as error:
+            print(f"Rebuilding the tables failed, retrying in {self.retry_interval} seconds: {error!r}")
+            self.rebuild_due = time.time() + self.retry_interval
+            # A new connection is opened in case the connection is what failed
+            self.closeConnection()
+            return False
+        self.rebuild_due = None
+        return True
+
+
+    def closeConnection(self):
+        # Closes the upload pool's connections along with the daemon's own
+        if self.uploads is not None:
+            try:
+                self.uploads.close()
+            except Exception:
+                pass
+            self.uploads = None
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+        self.connection = None
+        self.cursor = None
+
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        self.closeConnection()
+
+
+# Responses worth retrying a download after, along with dropped connections and timeouts
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def download_file(url, path, params=None, session=None, timeout=None, headers=None, chunk_size=1024 * 1024, verify=None):
+    '''
+    Downloads url (with the query params, if any) to path. Returns the ETag and Last-Modified headers of the
+    response, or None if headers held conditional request headers and the server answered 304 Not Modified.
+
+    The content is streamed into path + ".part" in large buffered writes, which is only renamed to path once it is
+    complete, so path is never a truncated file. Dropped connections and server errors are retried up to
+    DOWNLOAD_RETRIES times with exponential backoff, and each retry only asks for the rest of the file with a Range
+    request. The .part file is kept if every retry fails, along with the validators in path + ".part.json",
+    so the next run resumes it too unless the file changed upstream (If-Range).
+    The size is checked against the Content-Length or Content-Range of the response, and verify, if given,
+    is called with the path of the complete file and returns False if the content is corrupt, which is
+    then downloaded again from the start
+    '''
+    part_path = path + ".part"
+    state_path = part_path + ".json"
+    state = {}
+    if os.path.exists(part_path):
+        try:
+            with open(state_path) as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            state = {}
+
+    getter = session if session is not None else requests
+    error = None
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        if attempt > 0:
+            delay = min(2 ** (attempt - 1), DOWNLOAD_MAX_BACKOFF)
+            print(f"Download of {url.split('?')[0]} failed ({error}), retrying in {delay} seconds")
+            time.sleep(delay)
+
+        request_headers = dict(headers or {})
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if offset > 0 and state.get("resumable"):
+            request_headers["Range"] = f"bytes={offset}-"
+            request_headers["If-Range"] = state["etag"] or state["last_modified"]
+        else:
+            offset = 0
+        try:
+            with getter.get(url, params=params, headers=request_headers, stream=True, timeout=timeout) as resp:
+                if resp.status_code == 304 and headers:
+                    return None
+                # Content-Range: bytes start-end/total
+                content_range = resp.headers.get("Content-Range", "")
+                if resp.status_code == 416 or (resp.status_code == 206 and not content_range.startswith(f"bytes {offset}-")):
+                    # The partial file doesn't match the file on the server anymore, so it starts over
+                    error = f"could not resume at byte {offset}"
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                    state = {}
+                    continue
+                resp.raise_for_status()
+
+                total = None
+                encoded = resp.headers.get("Content-Encoding", "identity") != "identity"
+                if resp.status_code == 206:
+                    total = content_range.split("/")[-1]
+                    total = int(total) if total.isdigit() else None
+                else:
+                    # The server sent the whole file
+                    offset = 0
+                    if not encoded and resp.headers.get("Content-Length", "").isdigit():
+                        total = int(resp.headers["Content-Length"])
+
+                state = {"etag": resp.headers.get("ETag"),
+                         "last_modified": resp.headers.get("Last-Modified"),
+                         "resumable": not encoded and resp.headers.get("Accept-Ranges", "bytes") != "none"
+                                      and bool(resp.headers.get("ETag") or resp.headers.get("Last-Modified"))}
+                with open(state_path, "w") as state_file:
+                    json.dump(state, state_file)
+
+                # Reads in small pieces, so a dropped connection loses little of what was received,
+                # but only writes to disk chunk_size bytes at a time
+                with open(part_path, "ab" if offset else "wb", buffering=chunk_size) as part_file:
+                    for chunk in resp.iter_content(chunk_size=64 * 1024):
+                        part_file.write(chunk)
+                        metrics.add("bytes_downloaded", len(chunk))
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as exception:
+            error = exception
+            continue
+        except requests.HTTPError as exception:
+            if exception.response is None or exception.response.status_code not in RETRY_STATUS_CODES:
+                raise
+            error = exception
+            continue
+
+        size = os.path.getsize(part_path)
+        if total is not None and size != total:
+            error = f"received {size} of {total} bytes"
+            continue
+        if verify is not None and not verify(part_path):
+            error = "the downloaded file is corrupt"
+            os.remove(part_path)
+            os.remove(state_path)
+            state = {}
+            continue
+        os.replace(part_path, path)
+        os.remove(state_path)
+        return {"etag": state["etag"], "last_modified": state["last_modified"]}
+
+    raise IOError(f"Download of {url} failed after {DOWNLOAD_RETRIES + 1} attempts: {error}")
+
+
+def is_complete_zip(path):
+    '''
+    Checks the CRC of every file in a zip, returns False if the zip is truncated or any file is corrupt
+    '''
+    try:
+        with zipfile.ZipFile(path) as zip_file:
+            return zip_file.testzip() is None
+    except (zipfile.BadZipFile, zlib.error, OSError, EOFError):
+        return False
+
+
+class DownloadCache:
+    '''
+    Local content-addressed cache for downloaded files
+
+    Every url has a small json entry holding the ETag and Last-Modified validators the server sent along with
+    the sha256 of the content, and the content itself is stored once under blobs/ by that sha256.
+    When a url is requested again the validators are sent as a conditional request, so a source that hasn't
+    changed upstream costs a single 304 response instead of a full download.
+    Entries older than max_age (seconds) are downloaded again in full in case a server's validators can't be trusted,
+    and evict() removes the least recently used content once the cache holds more than max_bytes.
+    '''
+
+    def __init__(self, cache_dir, max_bytes, max_age):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.entries_dir = os.path.join(cache_dir, "entries")
+        self.blobs_dir = os.path.join(cache_dir, "blobs")
+        os.makedirs(self.entries_dir, exist_ok=True)
+        os.makedirs(self.blobs_dir, exist_ok=True)
+
+
+    def fetch(self, url, params=None, session=None, timeout=None, verify=None):
+        '''
+        Returns the local path of the content at url (with the query params, if any),
+        only downloading it when it isn't cached, the cached copy is too old, or it changed upstream.
+        Downloads are retried and resumed, see download_file(), which also describes verify
+        '''
+        full_url = requests.Request('GET', url, params=params).prepare().url
+        entry_path = os.path.join(self.entries_dir, hashlib.sha1(full_url.encode()).hexdigest() + ".json")
+        entry = self.readEntry(entry_path)
+        if entry is not None and (time.time() - entry["fetched"] >= self.max_age
+                                  or not os.path.exists(self.blobPath(entry["sha256"]))):
+            entry = None
+
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        # Downloads next to the entry under a name of its own, so a download that fails is resumed by the next run
+        download_path = os.path.join(self.cache_dir, os.path.basename(entry_path)[:-len(".json")] + ".download")
+        validators = download_file(full_url, download_path, session=session, timeout=timeout, headers=headers,
+                                   verify=verify)
+        if validators is None:
+            # Not modified, the cached copy is still current
+            entry["used"] = time.time()
+            self.writeEntry(entry_path, entry)
+            return self.blobPath(entry["sha256"])
+
+        # Moves the content into place under its hash
+        sha256 = file_sha256(download_path)
+        blob_path = self.blobPath(sha256)
+        os.replace(download_path, blob_path)
+
+        now = time.time()
+        entry = {"url": full_url,
+                 "etag": validators["etag"],
+                 "last_modified": validators["last_modified"],
+                 "sha256": sha256,
+                 "size": os.path.getsize(blob_path),
+                 "fetched": now,
+                 "used": now}
+        self.writeEntry(entry_path, entry)
+        return blob_path
+
+
+    def evict(self):
+        '''
+        Removes entries older than max_age, then keeps the most recently used content that fits in max_bytes
+        and deletes the rest. Should be called once a stage is done reading the paths returned by fetch()
+        '''
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.entries_dir):
+            entry_path = os.path.join(self.entries_dir, name)
+            entry = self.readEntry(entry_path)
+            if entry is None or now - entry["fetched"] >= self.max_age or not os.path.exists(self.blobPath(entry["sha256"])):
+                self.removeFile(entry_path)
+            else:
+                entries.append((entry_path, entry))
+
+        # Identical content from different urls is only stored, and counted, once
+        entries.sort(key=lambda path_entry: path_entry[1]["used"], reverse=True)
+        kept_blobs = set()
+        total_bytes = 0
+        for entry_path, entry in entries:
+            if entry["sha256"] in kept_blobs:
+                continue
+            if total_bytes + entry["size"] > self.max_bytes:
+                self.removeFile(entry_path)
+                continue
+            kept_blobs.add(entry["sha256"])
+            total_bytes += entry["size"]
+
+        for name in os.listdir(self.blobs_dir):
+            if name not in kept_blobs:
+                self.removeFile(os.path.join(self.blobs_dir, name))
+
+
+    def blobPath(self, sha256):
+        return os.path.join(self.blobs_dir, sha256)
+
+
+    def readEntry(self, entry_path):
+        # Returns None for missing or unreadable entries, which are treated as not cached
+        try:
+            with open(entry_path) as entry_file:
+                return json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+
+    def writeEntry(self, entry_path, entry):
+        # Writes to a temporary file first so other threads or processes never read a partial entry
+        handle, temp_path = tempfile.mkstemp(dir=self.entries_dir, suffix=".tmp")
+        with os.fdopen(handle, "w") as temp_file:
+            json.dump(entry, temp_file)
+        os.replace(temp_path, entry_path)
+
+
+    def removeFile(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def get_download_cache():
+    '''
+    Returns the download cache configured by the DOWNLOAD_CACHE constants, or None if caching is turned off
+    '''
+    if DOWNLOAD_CACHE_DIR is None:
+        return None
+    return DownloadCache(DOWNLOAD_CACHE_DIR, DOWNLOAD_CACHE_MAX_BYTES, DOWNLOAD_CACHE_MAX_AGE)
+
+
+def evict_download_cache():
+    '''
+    Evicts what no longer fits in the download cache, if caching is turned on. Only called once every source is done
+    downloading, since the sources share the cache and evicting could remove a file another source is still reading
+    '''
+    cache = get_download_cache()
+    if cache is not None:
+        cache.evict()
+
+
+def map_distinct(values, lookup):
+    '''
+    Returns lookup(value) for every value as a numpy object array, calling lookup once per distinct value.
+    Missing values map to None
+    '''
+    codes, uniques = pd.factorize(values)
+    # The last entry is picked by the code -1 of missing values
+    mapped = np.empty(len(uniques) + 1, dtype=object)
+    mapped[:-1] = [lookup(value) for value in uniques]
+    return mapped[codes]
+
+
+shared_country_index = None
+country_index_lock = threading.Lock()
+
+
+def get_country_index():
+    '''
+    Returns the CountryIndex every source resolves its countries with, set up on first use.
+    In global mode it covers every country in the world: the World Bank's list of countries and FAOSTAT's list of
+    areas are fetched once, FAO areas are matched to a country by their ISO3 code, and both sources take the name of
+    each country from the same table (the World Bank's spelling, or FAO's for the few it doesn't have). Otherwise
+    "United States" and FAO's "United States of America" would be two different countries
+    '''
+    global shared_country_index
+    with country_index_lock:
+        if shared_country_index is None:
+            if GLOBAL_MODE:
+                fao_areas = FAO(fetch=False).fetchAreaCodes()
+                names = dict(zip(fao_areas["ISO3 Code"], fao_areas["Country"]))
+                names.update(WorldBank(fetch=False).fetchCountryCodes())
+                shared_country_index = CountryIndex(names, dict(zip(fao_areas["Country Code"], fao_areas["ISO3 Code"])),
+                                                    dict(zip(fao_areas["Country"], fao_areas["ISO3 Code"])))
+            else:
+                shared_country_index = CountryIndex()
+        return shared_country_index
+
+
+class CountryIndex:
+    '''
+    Resolves the codes and names each source uses for a country to one key, its ISO3 code
+
+    normalize() filters a source's rows to the target countries and sets the name used in the output tables in
+    a single pass, looking up each distinct code or name once instead of running a replace over the whole column
+    for every alias. A name that matches no country is its own key, so a country missing from COUNTRY_CODES is
+    still matched by name. In global mode the targets are every country of the tables given, see get_country_index()
+    '''
+
+    def __init__(self, country_names=None, fao_area_codes=None, aliases=None):
+        # country_names: {ISO3 code: name} of every country in global mode, the names used in the output tables
+        # fao_area_codes: {FAO area code: ISO3 code} of every FAO area that is a country
+        # aliases: other {name: ISO3 code} spellings, ex: FAO's names of the countries in country_names
+        self.names = {}
+        self.keys_by_name = {}
+        self.keys_by_fao_code = {}
+        for name, (iso3, fao_code) in COUNTRY_CODES.items():
+            self.names[iso3] = name
+            self.keys_by_name[name] = iso3
+            self.keys_by_fao_code[fao_code] = iso3
+        self.keys_by_name.update(COUNTRY_ALIASES)
+        for iso3, name in (country_names or {}).items():
+            self.names.setdefault(iso3, name)
+            self.keys_by_name.setdefault(name, iso3)
+        for fao_code, iso3 in (fao_area_codes or {}).items():
+            self.keys_by_fao_code.setdefault(fao_code, iso3)
+        for name, iso3 in (aliases or {}).items():
+            self.keys_by_name.setdefault(name, iso3)
+        # With FAO's whole list of areas, an area code that isn't a country is never matched by its name instead,
+        # ex: 351 China would otherwise be taken for the World Bank's China
+        self.fao_codes_only = fao_area_codes is not None
+        # Keys of the countries list, or of every country with an ISO3 code in global mode
+        self.targets = set(self.names) if GLOBAL_MODE else {self.getKey(name) for name in countries}
+
+
+    def getKey(self, name):
+        return self.keys_by_name.get(name, name)
+
+
+    def getKeys(self, names, iso3_codes=None, fao_codes=None):
+        '''
+        Returns the key of every row: its ISO3 or FAO area code if it is a known one, its name otherwise.
+        With the whole list of FAO areas, rows are only matched by area code (see fao_codes_only)
+        '''
+        keys = map_distinct(names, self.getKey)
+        if iso3_codes is not None:
+            code_keys = map_distinct(iso3_codes, lambda code: code if code in self.names else None)
+            keys = np.where(pd.notna(code_keys), code_keys, keys)
+        if fao_codes is not None:
+            code_keys = map_distinct(fao_codes, self.keys_by_fao_code.get)
+            keys = code_keys if self.fao_codes_only else np.where(pd.notna(code_keys), code_keys, keys)
+        return keys
+
+
+    def normalize(self, df, column, iso3_col=None, fao_code_col=None, keep=None):
+        '''
+        Keeps the rows of df whose country is in keep (a set of keys, the countries list by default) and sets column
+        to the output name of each one. The code columns are dropped
+        NOTE: column is the name column, ex: "Area" for FAO and "Country" for the World Bank
+        '''
+        keys = self.getKeys(df[column],
+                            None if iso3_col is None else df[iso3_col],
+                            None if fao_code_col is None else df[fao_code_col])
+        keep = self.targets if keep is None else keep
+        if keep is not None:
+            kept = pd.Series(keys).isin(keep).to_numpy()
+            df = df[kept]
+            keys = keys[kept]
+        df = df.drop(columns=[col for col in (iso3_col, fao_code_col) if col is not None])
+        df[column] = map_distinct(keys, lambda key: self.names.get(key, key))
+        return df
 
 
 class WorldBank:
     '''
     World Bank Data Injestion
     
-    Imports indicator data from World Bank API. A csv is created for each indicator and then aggregated into one csv file.
+    Imports indicator data from World Bank API. A dataframe is created for each indicator and then aggregated into one dataframe.
     '''
     
     # List of all possible column names with associated indicator codes (country and year included in each csv)
@@ -426,36 +2518,48 @@ class WorldBank:
              'PA.NUS.FCRF',
              'ER.H2O.FWAG.ZS']
 
+    # API endpoint and fetching limits. max_workers caps how many requests are in flight at once,
+    # per_page is only a page size, every page the API reports is still fetched
+    api_url = 'http://api.worldbank.org/v2/country/all/indicator/'
+    countries_url = 'http://api.worldbank.org/v2/country'
+    max_workers = 8
+    per_page = 20000
+    timeout = 120
+
     
-    def __init__(self, final_name, delete_extra_csv_files=True, print_missing_countries=False):
-        # If user doesn't want the extra csv files deleted then they must initialize object with False as input
+    def __init__(self, parquet_path=None, print_missing_countries=False, fetch=True):
+        # The aggregated data is kept in self.df, and also saved to parquet_path if one is given
+        # If fetch is False, the object is only set up so indicators can be fetched with fetchIndicators()
         self.missing_countries = {}
-        self.scattered_csv_names = []
-        self.final_aggregated_csv_name = final_name
+        self.records = {}
+        self.indicator_dfs = {}
+        self.country_index = None
+        self.cache = get_download_cache()
+        if not fetch:
+            return
         print("Fetching World Bank data")
-        self.fetchData()
+        with metrics.stage("WorldBank.fetch") as stage:
+            self.fetchData()
+            stage["rows_out"] = sum(len(entries) for entries in self.records.values())
         print("Transforming World Bank data")
-        self.transformData()
-        if delete_extra_csv_files:
-            for filename in self.scattered_csv_names:
-                os.remove(filename)
+        with metrics.stage("WorldBank.transform", rows_in=sum(len(entries) for entries in self.records.values())) as stage:
+            self.transformData()
+            stage["rows_out"] = len(self.df)
+        save_parquet(self.df, parquet_path)
         if print_missing_countries:
-            printMissingCountries()
-        
-        
-    def wbRenameCountryNames(self, df):
+            self.printMissingCountries()
+
+
+    def fetchIndicators(self, codes, session=None):
         '''
-        Reassigns region names to be consistent, only includes Latin American countries at the moment
-        NOTE: "Country" must be the name for the country column
+        Fetches and transforms only the indicators in codes, over session if one is given.
+        Returns a dict of the dataframe of each indicator
         '''
-        name_map = [
-            ('Venezuela, RB','Venezuela'),
-            ('Bahamas, The','Bahamas')      
-        ]
-        for names in name_map:
-            df.Country = df.Country.replace(names[0], names[1])
-
-            
+        self.fetchData(codes, session)
+        self.transformData(codes)
+        return self.indicator_dfs
+        
+        
     def checkMissingCountries(self, df, countries):
         '''
         Checks if any target countries are missing from the dataframe
@@ -472,147 +2576,431 @@ class WorldBank:
     def printMissingCountries(self):
         # Prints out the missing target countries for each indicator dataset
         print("\n")
-        for kv in missing_countries.items():
+        for kv in self.missing_countries.items():
             print(f"{kv[0]} is missing data for {len(kv[1])} countries: \n{kv[1]}\n")
         
     
-    def fetchData(self):
+    def fetchData(self, codes=None, session=None):
         '''
-        Below, we are looping through each indicator following in the list of codes above, 
-        and pluggin each indicator into the url request.
-        
-        Need to set a max value for how many results per page
-        to do this, realize we have 259 countries and (current date - 1960) 
-        years worth of data. Set a max results per page > (total years)*(total countries)
-        '''
-        max_results = 20000
-        self.scattered_csv_names = []
-        for i in range(len(WorldBank.codes)):  
-            csv_file_name = WorldBank.codes[i]+"_yearly.csv"
-            self.scattered_csv_names.append(csv_file_name)
-            call = open(csv_file_name, 'w') # creating file name, this is for the gini index variable
-            write = csv.writer(call, dialect = 'excel') # where file will write to
-            # Writing the first row (country, year, variable = gini index)
-            write.writerow([WorldBank.headers[0],WorldBank.headers[1],WorldBank.headers[2],WorldBank.headers[i+3]])
-
-            url = 'http://api.worldbank.org/v2/country/all/indicator/'+str(WorldBank.codes[i])+'?per_page='+str(max_results)+'&format=json'
-            req = requests.get(url)
+        Fetches every indicator in codes (by default the list of codes above) from the World Bank API and keeps the
+        entries of each one in self.records. A new session is used unless one is given
+
+        The requests are made concurrently by a bounded thread pool sharing one keep-alive session, so the
+        whole stage takes about as long as the slowest indicator instead of the sum of all of them.
+        The first page of each indicator tells us how many pages there are, the remaining pages are then
+        queued on the same pool rather than assuming everything fits in one page of per_page results.
+        '''
+        codes = WorldBank.codes if codes is None else codes
+        if self.country_index is None:
+            self.country_index = get_country_index()
+        records = {code: {} for code in codes}
+
+        own_session = session is None
+        if own_session:
+            session = self.makeSession()
+        try:
+            with ThreadPoolExecutor(max_workers=WorldBank.max_workers) as executor:
+                pending = {executor.submit(self.fetchPage, session, code, 1): (code, 1) for code in codes}
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        code, page_number = pending.pop(future)
+                        total_pages, entries = future.result()
+                        records[code][page_number] = entries
+                        if page_number == 1:
+                            # Queues up the rest of this indicator's pages
+                            for next_page in range(2, total_pages + 1):
+                                pending[executor.submit(self.fetchPage, session, code, next_page)] = (code, next_page)
+        finally:
+            # A session that was given belongs to the caller, who closes it
+            if own_session:
+                session.close()
+
+        # Keeps the entries of each indicator in page order
+        self.records = {}
+        for code in codes:
+            pages = records[code]
+            self.records[code] = [entry for page_number in sorted(pages) for entry in pages[page_number]]
+
+
+    def fetchCountryCodes(self):
+        '''
+        Returns the ISO3 code and name of every country in the World Bank API. The indicator data also has rows for
+        regions and income groups, which are listed under the "Aggregates" region and left out
+        '''
+        req = requests.get(WorldBank.countries_url, params={'per_page': 1000, 'format': 'json'}, timeout=WorldBank.timeout)
+        req.raise_for_status()
+        metrics.add("bytes_downloaded", len(req.content))
+        page = req.json()
+        if len(page) < 2:
+            raise ValueError(f"World Bank API error for the country list: {page[0].get('message')}")
+        return {entry['id']: entry['name'] for entry in page[1] if entry['region']['value'].strip() != "Aggregates"}
+
+
+    def makeSession(self):
+        '''
+        Creates one requests session to share between all worker threads so connections are kept alive
+        and reused. The connection pool is sized to the number of workers
+        '''
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=WorldBank.max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+
+    def fetchPage(self, session, code, page_number):
+        '''
+        Requests one page of an indicator from the API.
+        Returns the total number of pages for the indicator and the list of entries on this page
+        '''
+        url = WorldBank.api_url+str(code)
+        params = {'per_page': WorldBank.per_page, 'page': page_number, 'format': 'json'}
+        if self.cache is not None:
+            with open(self.cache.fetch(url, params=params, session=session, timeout=WorldBank.timeout)) as page_file:
+                page = json.load(page_file)
+        else:
+            req = session.get(url, params=params, timeout=WorldBank.timeout)
+            req.raise_for_status()
+            metrics.add("bytes_downloaded", len(req.content))
             page = req.json()
-            for entry in range(len(page[1])):
-                country = page[1][entry]['country']['value']
-                countrycode = page[1][entry]['countryiso3code'] # pulling country iso3 code
-                value = page[1][entry]['value'] # pulling variable of interest value 
-                year = page[1][entry]['date'] # pulling year at which value occured
-                row = [country, countrycode, int(year), value] # creating row of (country, year, value)
-                write.writerow(row) # writing row to our csv
-            call.close()
-
-
-    def transformData(self):
-        # Data filtering, aggregation, and transformation into csv
-         
+
+        # The API answers with a single message object instead of [metadata, entries] for invalid requests
+        if len(page) < 2:
+            raise ValueError(f"World Bank API error for indicator {code}: {page[0].get('message')}")
+        # entries is null when the indicator has no data at all
+        return page[0]['pages'], page[1] or []
+
+
+    def transformData(self, codes=None):
+        # Data filtering, aggregation, and transformation into one dataframe per indicator in self.indicator_dfs,
+        # and all of them combined in self.df
+
         self.missing_countries = {}
-        cols = ["Country", "Year", "Indicator", "Value"]
-        WB_df = pd.DataFrame(columns=cols)
+        self.indicator_dfs = {}
 
-        for csv_file in self.scattered_csv_names:
-            # Expected input column format: ["Country", "Country Code", "Year" "{Indicator Name With Unit}"]
+        for code in (WorldBank.codes if codes is None else codes):
             # Desired output column format: ["Country", "Year" "Indicator", "Value"]
-            new_WB_df = pd.read_csv(csv_file)
-            indicator_name = new_WB_df.columns[3]
-            new_WB_df = new_WB_df.drop(columns=["Country Code"])
-            new_WB_df = new_WB_df.rename(columns={indicator_name: 'Value'})
+            entries = self.records[code]
+            indicator_name = WorldBank.headers[WorldBank.codes.index(code) + 3]
+            new_WB_df = pd.DataFrame({
+                "Country": pd.Series([entry['country']['value'] for entry in entries], dtype="object"),
+                "Country Code": pd.Series([entry['countryiso3code'] for entry in entries], dtype="object"),
+                "Year": pd.Series([int(entry['date']) for entry in entries], dtype="int64"), # year at which value occured
+                "Value": pd.Series([entry['value'] for entry in entries], dtype="float64") # variable of interest value
+            })
             new_WB_df["Indicator"] = "WB " + indicator_name
-            new_cols = ["Country", "Year", "Indicator", "Value"]
-            new_WB_df = new_WB_df[new_cols]
             new_WB_df = new_WB_df.dropna(subset=["Value"])
-            self.wbRenameCountryNames(new_WB_df)
-            self.missing_countries[csv_file] = self.checkMissingCountries(new_WB_df, countries)
-            new_WB_df = new_WB_df[new_WB_df.Country.isin(countries)]
-            WB_df = WB_df.append(new_WB_df)
+            # Matched to the target countries by ISO3 code, in global mode every country without the aggregates
+            new_WB_df = self.country_index.normalize(new_WB_df, "Country", iso3_col="Country Code")
+            if not GLOBAL_MODE:
+                self.missing_countries[code] = self.checkMissingCountries(new_WB_df, countries)
+            self.indicator_dfs[code] = apply_source_schema(new_WB_df)
 
-        WB_df.to_csv(self.final_aggregated_csv_name, index=False)
+        self.df = concat_source_dfs(self.indicator_dfs.values())
         
 
+def parse_fao_years(labels, interval_offset=1):
+    '''
+    Returns the year of each FAO year label as an int64 series with the index of labels. A label is a single year,
+    "2000" or "Y2000" as in the column names of the bulk files, or an interval, "2001-2003" or "Y20012003".
+    An interval is represented by the year interval_offset years after its end, 3-year averages are placed the year
+    after the years they average (2001-2003 -> 2004). Every distinct label is parsed once, by one regular
+    expression over all of them. Raises a ValueError for a label in neither format
+    '''
+    labels = pd.Series(labels)
+    codes, uniques = pd.factorize(labels.astype(str))
+    parts = pd.Series(uniques, dtype=object).str.extract(r"^\s*Y?(\d{4})(?:\s*-?\s*(\d{4}))?\s*$")
+    unknown = parts[0].isna().to_numpy()
+    if unknown.any():
+        raise ValueError(f"Unknown FAO year format: {list(uniques[unknown][:5])}")
+
+    years = parts[0].astype("int64").to_numpy()
+    is_interval = parts[1].notna().to_numpy()
+    years[is_interval] = parts[1][is_interval].astype("int64").to_numpy() + interval_offset
+    return pd.Series(years[codes], index=labels.index)
+
+
+def split_survey_labels(surveys):
+    '''
+    Splits FAO household survey labels into the area and year of each survey, returned as the Area and Year columns
+    of a dataframe with the index of surveys. ex: "Ghana - 1998-1999" -> "Ghana", 1999 and "Guinea-Bissau - 2002" ->
+    "Guinea-Bissau", 2002. A survey over two years gets the end of the interval instead of the year after it, since
+    a survey can follow one of the year before (ex: "Ghana - 1998-1999" and "Ghana - 2000"), unlike the averages
+    of the other sources. Raises a ValueError for a label that isn't an area followed by a year or interval
+    '''
+    surveys = pd.Series(surveys)
+    codes, uniques = pd.factorize(surveys.astype(str))
+    parts = pd.Series(uniques, dtype=object).str.extract(r"^(.*?)\s*-\s*(\d{4}(?:\s*-\s*\d{4})?)\s*$")
+    unknown = parts[0].isna().to_numpy()
+    if unknown.any():
+        raise ValueError(f"Unknown FAO survey format: {list(uniques[unknown][:5])}")
+
+    # Areas with "-" in their name are written with or without spaces around it
+    areas = parts[0].str.replace(r"\s*-\s*", "-", regex=True).str.strip().to_numpy()
+    years = parse_fao_years(parts[1], interval_offset=0).to_numpy()
+    return pd.DataFrame({"Area": areas[codes], "Year": years[codes]}, index=surveys.index)
+
+
 class FAO:
     '''
     FAO Data Injestion 
 
-    Imports indicator data from FAO API. A dataframe is created for each source / api call and then aggregated into one csv file.
+    Imports indicator data from FAO API. A dataframe is created for each source / api call and then aggregated into one dataframe.
     '''
 
-    def __init__(self, final_name, get_core_items=True):
+    # Size of the chunks used when downloading files (bytes) and when parsing the bulk csv files (rows)
+    download_chunk_size = 1024 * 1024
+    csv_chunk_size = 200000
+
+    # Number of sources run at the same time, how long (seconds) they all have to finish before the run fails,
+    # and how long a single request can go without receiving data
+    max_workers = 6
+    source_timeout = 60 * 60
+    request_timeout = 300
+
+    # Base urls of the bulk downloads and the api
+    bulk_url = 'http://fenixservices.fao.org/faostat/static/bulkdownloads/'
+    api_url = 'http://fenixservices.fao.org/faostat/api/v1/en/data/'
+    # List of every area with its ISO3 code, used to match areas to countries in GLOBAL_MODE
+    areas_url = 'http://fenixservices.fao.org/faostat/api/v1/en/definitions/types/area'
+
+    # Areas that contain other areas of the list, left out so nothing is counted twice: 351 China is the sum of
+    # 41 China, mainland, 96 Hong Kong, 128 Macao and 214 Taiwan. FAO gives China, mainland a code of its own
+    # instead of an ISO3 code, it is the World Bank's CHN
+    overlapping_area_codes = [351]
+    area_iso3_codes = {41: 'CHN'}
+
+    # Regions the bulk files are split into. In GLOBAL_MODE the bulk sources (1, 2, and 5) are run once per region
+    # instead of once on the Latin America or All_Data file
+    regions = ['Africa', 'Americas', 'Asia', 'Europe', 'Oceania']
+    bulk_sources = [1, 2, 5]
+
+    def __init__(self, parquet_path=None, get_core_items=True, fetch=True):
+        # The aggregated data is kept in self.df, and also saved to parquet_path if one is given
+        # If fetch is False, the object is only set up so single sources can be run by calling them
         self.get_core_items = get_core_items
-        self.final_aggregated_csv_name = final_name
-        print("FAO Source 1:")
-        FAO_df = self.source1()
-        print("FAO Source 2:")
-        FAO_df = FAO_df.append(self.source2())
-        print("FAO Source 3:")
-        FAO_df = FAO_df.append(self.source3())
-        print("FAO Source 4:")
-        FAO_df = FAO_df.append(self.source4())
-        print("FAO Source 5:")
-        FAO_df = FAO_df.append(self.source5())
-        print("FAO Source 6:")
-        FAO_df = FAO_df.append(self.source6())
-
-        # Rearrange and rename columns
-        new_cols = ["Area", "Year", "Item", "Value"]
-        FAO_df = FAO_df[new_cols]
-        # Rename indicator column
-        FAO_df = FAO_df.rename(columns={'Area': 'Country'})
-        FAO_df = FAO_df.rename(columns={'Item': 'Indicator'})
+        self.cache = get_download_cache()
+        # Copied onto the object so that the worker processes running the sources see any changes to them
+        self.bulk_url = FAO.bulk_url
+        self.api_url = FAO.api_url
+        self.global_mode = GLOBAL_MODE
+        self.country_index = None
+        if fetch:
+            self.fetchSources(parquet_path)
 
-        FAO_df.to_csv(final_name, index=False)
 
-    def getFile(self, url, file_name):
+    def fetchSources(self, parquet_path=None):
         '''
-        Uses a binary stream to download a file from an api call
+        Runs every source and combines them into self.df
         '''
-        r = requests.get(url, stream=True)
-        handle = open(file_name, "wb")
-        for chunk in r.iter_content(chunk_size=512):
-            if chunk:  # filter out keep-alive new chunks
-                handle.write(chunk)
-        handle.close()
+        # Each source is an independent download followed by pandas work, so they all run at the same time in
+        # a pool of processes. Downloads overlap and the parsing of each source gets its own cpu.
+        pool = make_worker_pool()
+        try:
+            source_dfs = self.runTasks(pool, self.getTasks())
+        finally:
+            # Also stops any source that is still running after a failure or timeout
+            pool.terminate()
+            pool.join()
+
+        self.df = self.combineSources(source_dfs)
+        save_parquet(self.df, parquet_path)
 
 
-    def getCsvFromOnlineZip(self, url, zip_path, csv_name):
+    def runTasks(self, pool, tasks, errors=None):
+        '''
+        Runs the (source number, region) tasks in the pool of worker processes and returns the dataframe of each one.
+        If errors is a dict, a task that fails is recorded in it with its error and gets None instead of a dataframe,
+        otherwise the first error is raised
+        '''
+        # Set up before the object is sent to the worker processes, so they don't each have to
+        self.getCountryIndex()
+        pending = [pool.apply_async(self.runSource, task) for task in tasks]
+        deadline = time.time() + FAO.source_timeout
+        source_dfs = []
+        for (number, region), result in zip(tasks, pending):
+            source_name = f"FAO Source {number}" + (f" ({region})" if region else "")
+            try:
+                try:
+                    source_df, source_stages = result.get(timeout=max(0, deadline - time.time()))
+                except multiprocessing.TimeoutError:
+                    raise TimeoutError(f"{source_name} did not finish within {FAO.source_timeout} seconds")
+            except Exception as error:
+                if errors is None:
+                    raise
+                errors[(number, region)] = error
+                source_dfs.append(None)
+                continue
+            source_dfs.append(source_df)
+            metrics.addStages(source_stages)
+            print(f"{source_name}: {len(source_df)} rows")
+        return source_dfs
+
+
+    def combineSources(self, source_dfs):
+        '''
+        Combines the dataframes of the sources into one, all at once instead of copying the data on every append
+        '''
+        df = concat_source_dfs(source_dfs)
+        if self.global_mode:
+            # A country listed in more than one region's file is only kept once
+            df = df.drop_duplicates(subset=["Country", "Year", "Indicator"]).reset_index(drop=True)
+        return df
+
+
+    def getTasks(self):
+        '''
+        Returns the (source number, region) pairs to run. The region is None for a source's default file.
+        In global mode each region of a bulk source is a separate task, so no process holds more than one region
+        '''
+        tasks = []
+        for number in range(1, 7):
+            if self.global_mode and number in FAO.bulk_sources:
+                tasks.extend((number, region) for region in FAO.regions)
+            else:
+                tasks.append((number, None))
+        return tasks
+
+
+    def runSource(self, number, region=None):
+        '''
+        Runs source number in a worker process as its own stage, on the given region's bulk file if there is one.
+        Returns the source's dataframe along with the stages recorded while running it, since the worker's metrics
+        aren't shared with the main process
+        '''
+        global metrics
+        metrics = RunMetrics()
+        with metrics.stage(f"FAO.source{number}.run" + (f" {region}" if region else "")) as stage:
+            if region is not None:
+                source_df = getattr(self, f"source{number}")(region)
+            else:
+                source_df = getattr(self, f"source{number}")()
+
+            # Rearrange and rename columns, then converts them to the shared types before the dataframe
+            # is sent back, which also makes it much smaller to send
+            source_df = source_df[["Area", "Year", "Item", "Value"]]
+            source_df = source_df.rename(columns={'Area': 'Country', 'Item': 'Indicator'})
+            source_df = apply_source_schema(source_df).reset_index(drop=True)
+            stage["rows_out"] = len(source_df)
+        return source_df, metrics.stages
+
+
+    def getFile(self, url, file_name, verify=None):
+        '''
+        Downloads a file from an api call, retrying and resuming it if the connection drops (see download_file)
+        Returns the path to read the file from, which is the download cache's copy when caching is turned on
+        '''
+        if self.cache is not None:
+            return self.cache.fetch(url, timeout=FAO.request_timeout, verify=verify)
+
+        download_file(url, file_name, timeout=FAO.request_timeout, chunk_size=FAO.download_chunk_size, verify=verify)
+        return file_name
+
+
+    def readCsvFile(self, url, file_name):
+        '''
+        Downloads a csv from an api call and returns it as a dataframe, then removes the file if it isn't cached
+        '''
+        csv_path = self.getFile(url, file_name)
+        try:
+            df = pd.read_csv(csv_path)
+        finally:
+            if self.cache is None:
+                os.remove(csv_path)
+        metrics.add("rows_in", len(df))
+        return df
+
+
+    def getCsvFromOnlineZip(self, url, zip_path, csv_name, usecols=None, dtype=None, encoding=None, filter_chunk=None):
         '''
         url: url of zip folder to download
         zip_path: what to name zip file in local file system
-        csv_name: name of csv in zip file and how it is saved in local file system
+        csv_name: name of csv in zip file
+        usecols: list of columns or a function of the column name, passed on to pd.read_csv
+        dtype: dict of column types or a function of the column name that returns its type
+        encoding: encoding of the csv
+        filter_chunk: optional function that takes a chunk of rows and returns the rows to keep
+
+        downloads the zip file (or reuses the cached copy), decompresses the relevant csv straight into a chunked
+        csv reader, and then removes the zip file if it isn't cached. Only the zip is ever written to disk and peak memory is bounded by the chunk size
+        plus whatever rows filter_chunk keeps, instead of holding the whole decompressed csv.
+        Returns the csv as a dataframe
+        '''
+        # Every file in the zip is checked against its CRC before it's used
+        zip_file_path = self.getFile(url, zip_path, verify=is_complete_zip)
+
+        try:
+            with zipfile.ZipFile(zip_file_path, 'r') as zip_file:
+                if callable(dtype):
+                    # Reads only the header to resolve the type of each column that will be kept
+                    with zip_file.open(csv_name) as member:
+                        header = pd.read_csv(member, nrows=0, usecols=usecols, encoding=encoding).columns
+                    dtype = {col: dtype(col) for col in header}
+
+                with zip_file.open(csv_name) as member:
+                    reader = pd.read_csv(member, usecols=usecols, dtype=dtype, encoding=encoding,
+                                         chunksize=FAO.csv_chunk_size)
+                    chunks = []
+                    for chunk in reader:
+                        metrics.add("rows_in", len(chunk))
+                        if filter_chunk is not None:
+                            chunk = filter_chunk(chunk)
+                        chunks.append(chunk)
+        finally:
+            if self.cache is None:
+                os.remove(zip_path)
+
+        return pd.concat(chunks, ignore_index=True)
+
+
+    def bulkColumnType(self, column):
+        '''
+        Column types for the FAO bulk csv files. Year columns (Yxxxx) are read as text since some items have values
+        like "<2.5", they are converted by yearValues once the rows we keep are filtered
+        '''
+        if column == "Area Code":
+            return "int64"
+        return "object"
 
-        downloads the zip file, extracts and saves the relevant csv, and then removes the zip file
+
+    def yearValues(self, df):
+        '''
+        Converts the year columns (Yxxxx) of a filtered bulk csv chunk to numbers, anything that isn't a number is missing
         '''
-        self.getFile(url, zip_path)
+        year_cols = [col for col in df.columns if col.startswith("Y")]
+        return df.assign(**{col: pd.to_numeric(df[col], errors="coerce").astype("float64") for col in year_cols})
 
-        # Extracts the relevant csv file from the zip file
-        with zipfile.ZipFile(zip_path, 'r') as zip_file:
-            with open(csv_name, 'wb') as bulk_csv:
-                bulk_csv.write(zip_file.read(csv_name))
 
-        # Deletes the zip file, leaving just the relevant csv
-        # NOTE: If the section above runs into an error, the zip file won't be removed
-        os.remove(zip_path)
+    def getCountryIndex(self):
+        if self.country_index is None:
+            self.country_index = get_country_index()
+        return self.country_index
 
 
-    def faoRenameAreaNames(self, df):
-        # Reassigns region names to be consistent, only include Latin American countries at the moment
-        # NOTE: "Area" must be the name for the country column
-        name_map = [
-            ('Venezuela (Bolivarian Republic of)','Venezuela'),
-            ('Bolivia (Plurinational State of)','Bolivia'),
-            ('Saint Kitts and Nevis','St. Kitts and Nevis'),
-            ('Saint Lucia','St. Lucia'),
-            ('Saint Vincent and the Grenadines','St. Vincent and the Grenadines')
-        ]
-        for names in name_map:
-            df.Area = df.Area.replace(names[0], names[1])
+    def fetchAreaCodes(self):
+        '''
+        Returns the "Country Code" (the FAO area code), "Country" and "ISO3 Code" of every FAOSTAT area that is a
+        country. Areas without a standard ISO3 code and the ones in overlapping_area_codes are left out
+        '''
+        areas = self.readCsvFile(FAO.areas_url + "?output_type=csv", "FAO_Area_Codes.csv")
+        iso3_codes = areas["Country Code"].map(FAO.area_iso3_codes).fillna(areas["ISO3 Code"]).astype(str)
+        areas = areas[["Country Code", "Country"]].assign(**{"ISO3 Code": iso3_codes})
+        kept = iso3_codes.str.fullmatch("[A-Z]{3}") & ~areas["Country Code"].isin(FAO.overlapping_area_codes)
+        return areas[kept]
 
 
-    def source1(self):
+    def filterAreas(self, df, area_code_col="Area Code"):
+        '''
+        Keeps the rows of the target countries (every country in global mode) and sets Area to the name used in the
+        output. Countries are matched by area code, so regional aggregates (ex: "World", "South America") and areas
+        that overlap a country, like 351 China, are left out since their codes don't resolve to a country.
+        This can run before anything else touches the rows. The area code column is dropped
+        '''
+        return self.getCountryIndex().normalize(df, "Area", fao_code_col=area_code_col)
+
+
+    def source1(self, region='Latin_America_and_the_Caribbean'):
         ''' 
         Source 1: FAO - Suite of Food Security Indicators - http://www.fao.org/faostat/en/#data/FS
          
@@ -645,22 +3033,21 @@ class FAO:
                     'Prevalence of obesity in the adult population (18 years and older)']
 
         # url to get bulk csv zip file. zip_path is how I save the zip file locally
-        url = 'http://fenixservices.fao.org/faostat/static/bulkdownloads/Food_Security_Data_E_Latin_America_and_the_Caribbean.zip'
-        zip_path = 'Food_Security_Data_E_Latin_America_and_the_Caribbean.zip'
-
-        # Name of bulk csv file in zip file and how I save it locally
-        csv_name = 'Food_Security_Data_E_Latin_America_and_the_Caribbean_NOFLAG.csv'
-
-        self.getCsvFromOnlineZip(url, zip_path, csv_name)
+        url = self.bulk_url + f'Food_Security_Data_E_{region}.zip'
+        zip_path = f'Food_Security_Data_E_{region}.zip'
 
+        # Name of bulk csv file in zip file
+        csv_name = f'Food_Security_Data_E_{region}_NOFLAG.csv'
 
         # #### Data alteration and filtering
 
-        # csv --> dataframe
-        FAO_df = pd.read_csv(csv_name)
-
-        # drop unnecessary columns, assuming the unit is included in the item description
-        FAO_df = FAO_df.drop(columns=["Area Code", "Item Code", "Element Code", "Element", "Unit"])
+        # zipped csv --> dataframe
+        # only reads the area, item, and year columns, assuming the unit is included in the item description,
+        # and only keeps the target indicators of target countries from each chunk
+        FAO_df = self.getCsvFromOnlineZip(url, zip_path, csv_name,
+                                          usecols=lambda col: col in ("Area Code", "Area", "Item") or col.startswith("Y"),
+                                          dtype=self.bulkColumnType,
+                                          filter_chunk=lambda chunk: self.yearValues(self.filterAreas(chunk[chunk.Item.isin(indicators)])))
 
         # restructure to have Area, Item, and Year define each row
         FAO_df = FAO_df.melt(id_vars=["Area", "Item"], var_name="Year", value_name="Value")
@@ -669,27 +3056,7 @@ class FAO:
         FAO_df = FAO_df.dropna(subset=["Value"])
 
         # Reformatting the year. ex: Turns Y2000 into 2000 and Y20002002 into 2003
-        # Assumptions: Format is in Yxxxx or Yxxxxxxxx, where x could be any number
-        FAO_df.Year = FAO_df.Year.str.strip("Y")
-
-        year_list = FAO_df.Year.tolist()
-        for i in range(len(year_list)):
-            temp_year = year_list[i]
-            if len(temp_year) > 4:
-                year_list[i] = str(int(temp_year[4:])+1)
-        FAO_df.Year = year_list
-
-        FAO_df.Year = FAO_df.Year.astype(int)
-
-        # Reassigning region names to be consistent
-        self.faoRenameAreaNames(FAO_df)
-
-        # Filter dataframe to only include target countries (only removes Puerto Rico for Latin America dataset)
-        # NOTE: this must take place after region names are reassigned
-        FAO_df = FAO_df[FAO_df.Area.isin(countries)]
-
-        # Filter dataframe to only include target indicators
-        FAO_df = FAO_df[FAO_df.Item.isin(indicators)]
+        FAO_df.Year = parse_fao_years(FAO_df.Year)
 
         # Renaming indicators to include "FAO" for distintion when combining dataframes
         FAO_df.Item = "FAO " + FAO_df.Item
@@ -698,7 +3065,7 @@ class FAO:
         return FAO_df
 
 
-    def source2(self):
+    def source2(self, region='All_Data'):
         '''
         Source 2: FAO - Crops and livestock products - http://www.fao.org/faostat/en/#data/TP
 
@@ -711,14 +3078,11 @@ class FAO:
 
         # Data fetching
         # url to get bulk csv zip file. zip_path is how I save the zip file locally
-        url = 'http://fenixservices.fao.org/faostat/static/bulkdownloads/Trade_CropsLivestock_E_All_Data.zip'
-        zip_path = 'Trade_CropsLivestock_E_All_Data.zip'
-
-        # Name of bulk csv file in zip file and how I save it locally
-        csv_name = 'Trade_Crops_Livestock_E_All_Data_NOFLAG.csv'
-
-        self.getCsvFromOnlineZip(url, zip_path, csv_name)
+        url = self.bulk_url + f'Trade_CropsLivestock_E_{region}.zip'
+        zip_path = f'Trade_CropsLivestock_E_{region}.zip'
 
+        # Name of bulk csv file in zip file
+        csv_name = f'Trade_Crops_Livestock_E_{region}_NOFLAG.csv'
 
         # Data filtering
         '''
@@ -728,11 +3092,13 @@ class FAO:
         I could not find any data that looks encoded incorrectly and do not know why complex
              characters would even be in this simple dataset. This is simply a warning.
         '''
-        FAO_cl_df = pd.read_csv(csv_name, encoding="latin1")
-
-        # Filters out Import and export quantities
+        # Filters out Import and export quantities and other countries while reading each chunk
+        # Item is not read because the values are summed across all items below
         indicators = ["Export Value", "Import Value"]
-        FAO_cl_df = FAO_cl_df[FAO_cl_df.Element.isin(indicators)]
+        FAO_cl_df = self.getCsvFromOnlineZip(url, zip_path, csv_name,
+                                             usecols=lambda col: col in ("Area Code", "Area", "Element", "Unit") or col.startswith("Y"),
+                                             dtype=self.bulkColumnType, encoding="latin1",
+                                             filter_chunk=lambda chunk: self.yearValues(self.filterAreas(chunk[chunk.Element.isin(indicators)])))
         
         '''
         Let the element column include the unit, so we can drop the unit column
@@ -744,17 +3110,16 @@ class FAO:
         FAO_cl_df["Element"] = FAO_cl_df["Element"] + " (" + FAO_cl_df["Unit"] + ")"
 
         # Drop unnecessary columns
-        FAO_cl_df = FAO_cl_df.drop(columns=["Area Code", "Item Code", "Element Code", "Unit"])
+        FAO_cl_df = FAO_cl_df.drop(columns=["Unit"])
 
-        # Restructure to have Area, Item, and Year define each row
-        FAO_cl_df = FAO_cl_df.melt(id_vars=["Area", "Item", "Element"], var_name="Year", value_name="Value")
+        # Restructure to have Area, Element, and Year define each row
+        FAO_cl_df = FAO_cl_df.melt(id_vars=["Area", "Element"], var_name="Year", value_name="Value")
 
         # Dropping rows with null values
         FAO_cl_df = FAO_cl_df.dropna(subset=["Value"])
 
         # Reformatting the year. ex: Turns Y2000 into 2000
-        # Assumptions: Format is in Yxxxx, where x could be any number
-        FAO_cl_df.Year = FAO_cl_df.Year.str.strip("Y")
+        FAO_cl_df.Year = parse_fao_years(FAO_cl_df.Year)
 
         
         # Data aggregation and more filtering
@@ -772,13 +3137,6 @@ class FAO:
 
         FAO_cl_df = FAO_cl_df.rename(columns={'Element': 'Item'})
 
-        # Reassigning region names to be consistent
-        self.faoRenameAreaNames(FAO_cl_df)
-
-        # Filter dataframe to only include target countries
-        # NOTE: this must take place after region names are reassigned
-        FAO_cl_df = FAO_cl_df[FAO_cl_df.Area.isin(countries)]
-
         # final: 
         return FAO_cl_df
 
@@ -791,36 +3149,21 @@ class FAO:
         '''
         
         # Data fetching
-        api_call = 'http://fenixservices.fao.org/faostat/api/v1/en/data/FS?item=21035&output_type=csv'
+        api_call = self.api_url + 'FS?item=21035&output_type=csv'
         csv_name = "FAO_Cereal_import_dependency_ratio.csv"
-        self.getFile(api_call, csv_name)
 
 
         # Data filtering
-        FAO_cidr_df = pd.read_csv(csv_name)
+        FAO_cidr_df = self.readCsvFile(api_call, csv_name)
+        FAO_cidr_df = self.filterAreas(FAO_cidr_df)
 
         # Altering year interval to be one year (ex: 2001-2003 -> 2004)
-        year_list = FAO_cidr_df.Year.tolist()
-        for i in range(len(year_list)):
-            year_interval = year_list[i].split("-")
-            if len(year_interval) != 2:
-                # print(f"Format error: {year_interval}")
-                continue
-            end_year = int(year_interval[1].strip()) + 1
-            year_list[i] = str(end_year)
-        FAO_cidr_df.Year = year_list
+        FAO_cidr_df.Year = parse_fao_years(FAO_cidr_df.Year)
 
         # Drop unnecessary columns
-        FAO_cidr_df = FAO_cidr_df.drop(columns=["Domain Code", "Domain", "Area Code", "Item Code", "Element Code", "Element", 
+        FAO_cidr_df = FAO_cidr_df.drop(columns=["Domain Code", "Domain", "Item Code", "Element Code", "Element", 
                                                 "Year Code", "Unit", "Flag", "Flag Description", "Note"])
 
-        # Reassigning region names to be consistent
-        self.faoRenameAreaNames(FAO_cidr_df)
-
-        # Filter dataframe to only include target countries
-        # NOTE: this must take place after region names are reassigned
-        FAO_cidr_df = FAO_cidr_df[FAO_cidr_df.Area.isin(countries)]
-
         # Additional formatting
         FAO_cidr_df.Item = "FAO " + FAO_cidr_df.Item
 
@@ -843,45 +3186,16 @@ class FAO:
         --
         '''
         # Data fetching
-        api_call = 'http://fenixservices.fao.org/faostat/api/v1/en/data/HS?        survey=32005%2C522006%2C1620002001%2C162005%2C1920032004%2C1152004%2C1152009%2C392009%2C1072002%2C591997%2C8119981999%2C892006%2C9319992000%2C972004%2C1032007%2C11420052006%2C1202008%2C1262002%2C13020042005%2C1332001%2C1382004%2C1382006%2C1382008%2C14420022003%2C14919951996%2C15820072008%2C16520052006%2C1662008%2C1681996%2C16919971998%2C1712003%2C1462006%2C3819992000%2C2062009%2C2082007%2C1762001%2C2172006%2C22620022003%2C22620052006%2C23620042005%2C23719921993%2C2372006%2C25120022003&breakdownvar=2307%3E&breakdownsex=20000&indicator=6067&measure=6076&show_codes=true&show_unit=true&show_flags=true&null_values=false&output_type=csv'
+        api_call = self.api_url + 'HS?        survey=32005%2C522006%2C1620002001%2C162005%2C1920032004%2C1152004%2C1152009%2C392009%2C1072002%2C591997%2C8119981999%2C892006%2C9319992000%2C972004%2C1032007%2C11420052006%2C1202008%2C1262002%2C13020042005%2C1332001%2C1382004%2C1382006%2C1382008%2C14420022003%2C14919951996%2C15820072008%2C16520052006%2C1662008%2C1681996%2C16919971998%2C1712003%2C1462006%2C3819992000%2C2062009%2C2082007%2C1762001%2C2172006%2C22620022003%2C22620052006%2C23620042005%2C23719921993%2C2372006%2C25120022003&breakdownvar=2307%3E&breakdownsex=20000&indicator=6067&measure=6076&show_codes=true&show_unit=true&show_flags=true&null_values=false&output_type=csv'
         csv_name = "FAO_Share_of_food_consumption_in_total_income.csv"
-        self.getFile(api_call, csv_name)
 
 
         # Data filtering
-        FAO_sofciti_df = pd.read_csv(csv_name)
+        FAO_sofciti_df = self.readCsvFile(api_call, csv_name)
         
-        '''
-        Altering Survey column to expand into the year and area columns
-        (ex: 'Ghana - 1998-1999' -> 'Ghana', '1999')
-        Assumptions: format is in "{country} - {year}" or "{country} - {year}-{year}"
-        Notice that in this case I decide to use the end of the interval instead of the following year
-        This is to conform to the dashboard format and because these surveys represent two years or one per row,
-           This avoids errors with the case where there could be entries such as:
-              'Ghana - 1998-1999' and 'Ghana - 2000'
-           In the other datasets, an indicator represented an interval or a single year, and we cannot
-              make that assumption here
-        '''
-        year_list = []
-        country_list = []
-        survey_list = FAO_sofciti_df.Survey.tolist()
-        for survey in survey_list:
-            survey_split = survey.split("-")
-            year = int(survey_split[-1].strip())
-            year_list.append(year)
-
-            # This is to account for countries that might contain "-" in their name
-            country = survey_split[0].strip()
-            for entry in survey_split[1:]:
-                try:
-                    int(entry.strip())
-                    break
-                except ValueError:
-                    country += "-" + entry.strip()
-            country_list.append(country)
-
-        FAO_sofciti_df["Area"] = country_list
-        FAO_sofciti_df["Year"] = year_list
+        # Altering Survey column to expand into the year and area columns (ex: 'Ghana - 1998-1999' -> 'Ghana', 1999)
+        # Notice that in this case the end of the interval is used instead of the following year, see split_survey_labels
+        FAO_sofciti_df[["Area", "Year"]] = split_survey_labels(FAO_sofciti_df.Survey)
 
         # Drop unnecessary columns
         # Assumptions: One measure value (mean in this case), Unit is in indicator
@@ -890,8 +3204,8 @@ class FAO:
                                                  "Breadown by Sex of the Household Head", "Indicator Code", 
                                                  "Measure Code", "Measure", "Unit", "Flag", "Flag Description"])
 
-        self.faoRenameAreaNames(FAO_sofciti_df)
-        FAO_sofciti_df = FAO_sofciti_df[FAO_sofciti_df.Area.isin(countries)]
+        # Surveys are only labelled with the country's name
+        FAO_sofciti_df = self.getCountryIndex().normalize(FAO_sofciti_df, "Area")
 
         FAO_sofciti_df = FAO_sofciti_df.rename(columns={'Indicator': 'Item'})
 
@@ -901,7 +3215,7 @@ class FAO:
         return FAO_sofciti_df
 
 
-    def source5(self):
+    def source5(self, region='All_Data'):
         '''
         Source 5: FAO - Employment Indicators - http://www.fao.org/faostat/en/#data/HS
         Yields the indicators -> labeled in csv as:
@@ -916,34 +3230,28 @@ class FAO:
 
         # Data fetching
         # url to get bulk csv zip file. zip_path is how I save the zip file locally
-        url = 'http://fenixservices.fao.org/faostat/static/bulkdownloads/Employment_Indicators_E_All_Data.zip'
-        zip_path = 'Employment_Indicators_E_All_Data.zip'
-
-        # Name of bulk csv file in zip file and how I save it locally
-        csv_name = 'Employment_Indicators_E_All_Data_NOFLAG.csv'
+        url = self.bulk_url + f'Employment_Indicators_E_{region}.zip'
+        zip_path = f'Employment_Indicators_E_{region}.zip'
 
-        self.getCsvFromOnlineZip(url, zip_path, csv_name)    
+        # Name of bulk csv file in zip file
+        csv_name = f'Employment_Indicators_E_{region}_NOFLAG.csv'
 
         # Data filtering
+        # Only reads the needed columns and keeps the target indicators of target countries from each chunk
         # Warning: latin1 encoding, not utf-8
-        FAO_ei_df = pd.read_csv(csv_name, encoding="latin1")
+        FAO_ei_df = self.getCsvFromOnlineZip(url, zip_path, csv_name,
+                                             usecols=lambda col: col in ("Area Code", "Area", "Indicator", "Unit") or col.startswith("Y"),
+                                             dtype=self.bulkColumnType, encoding="latin1",
+                                             filter_chunk=lambda chunk: self.yearValues(self.filterAreas(chunk[chunk.Indicator.isin(indicators)])))
 
         # Rename indicator column
         FAO_ei_df = FAO_ei_df.rename(columns={'Indicator': 'Item'})
 
-        self.faoRenameAreaNames(FAO_ei_df)
-
-        # Filter dataframe to only include target indicators
-        FAO_ei_df = FAO_ei_df[FAO_ei_df.Item.isin(indicators)]
-
-        # Filter dataframe to only include target countries
-        FAO_ei_df = FAO_ei_df[FAO_ei_df.Area.isin(countries)]
-
         # Append unit to indicator
         FAO_ei_df.Item = FAO_ei_df.Item + " (" + FAO_ei_df.Unit + ")"
 
         # Drop unnecessary columns
-        FAO_ei_df = FAO_ei_df.drop(columns=["Area Code", "Source Code", "Source", "Indicator Code", "Unit"])
+        FAO_ei_df = FAO_ei_df.drop(columns=["Unit"])
 
         # Restructure to have Area, Item, and Year define each row
         FAO_ei_df = FAO_ei_df.melt(id_vars=["Area", "Item"], var_name="Year", value_name="Value")
@@ -952,8 +3260,7 @@ class FAO:
         FAO_ei_df = FAO_ei_df.dropna(subset=["Value"])
 
         # Reformatting the year. ex: Turns Y2000 into 2000
-        # Assumptions: Format is in Yxxxx, where x could be any number
-        FAO_ei_df.Year = FAO_ei_df.Year.str.strip("Y")
+        FAO_ei_df.Year = parse_fao_years(FAO_ei_df.Year)
 
         # Additional formatting
         FAO_ei_df.Item = "FAO " + FAO_ei_df.Item
@@ -976,29 +3283,24 @@ class FAO:
         '''
         # Data fetching
 
-        api_call = 'http://fenixservices.fao.org/faostat/api/v1/en/data/GT?area=2%2C3%2C4%2C5%2C6%2C7%2C258%2C8%2C9%2C1%2C22%2C10%2C11%2C52%2C12%2C13%2C16%2C14%2C57%2C255%2C15%2C23%2C53%2C17%2C18%2C19%2C80%2C20%2C21%2C239%2C26%2C27%2C233%2C29%2C35%2C115%2C32%2C33%2C36%2C37%2C39%2C259%2C40%2C351%2C96%2C128%2C214%2C41%2C44%2C45%2C46%2C47%2C48%2C98%2C49%2C50%2C167%2C51%2C107%2C116%2C250%2C54%2C72%2C55%2C56%2C58%2C59%2C60%2C61%2C178%2C63%2C209%2C238%2C62%2C65%2C64%2C66%2C67%2C68%2C69%2C70%2C74%2C75%2C73%2C79%2C81%2C82%2C84%2C85%2C86%2C87%2C88%2C89%2C90%2C175%2C91%2C93%2C94%2C95%2C97%2C99%2C100%2C101%2C102%2C103%2C104%2C264%2C105%2C106%2C109%2C110%2C112%2C108%2C114%2C83%2C118%2C113%2C120%2C119%2C121%2C122%2C123%2C124%2C125%2C126%2C256%2C129%2C130%2C131%2C132%2C133%2C134%2C127%2C135%2C136%2C137%2C270%2C138%2C145%2C140%2C141%2C273%2C142%2C143%2C144%2C28%2C147%2C148%2C149%2C150%2C151%2C153%2C156%2C157%2C158%2C159%2C160%2C161%2C154%2C163%2C162%2C221%2C164%2C165%2C180%2C299%2C166%2C168%2C169%2C170%2C171%2C172%2C173%2C174%2C177%2C179%2C117%2C146%2C183%2C185%2C184%2C182%2C187%2C188%2C189%2C190%2C191%2C244%2C192%2C193%2C194%2C195%2C272%2C186%2C196%2C197%2C200%2C199%2C198%2C25%2C201%2C202%2C277%2C203%2C38%2C276%2C206%2C207%2C260%2C210%2C211%2C212%2C208%2C216%2C176%2C217%2C218%2C219%2C220%2C222%2C223%2C213%2C224%2C227%2C228%2C226%2C230%2C225%2C229%2C215%2C240%2C231%2C234%2C235%2C155%2C236%2C237%2C243%2C205%2C249%2C248%2C251%2C181&area_cs=FAO&element=7231&item=1711&year=1961%2C1962%2C1963%2C1964%2C1965%2C1966%2C1967%2C1968%2C1969%2C1970%2C1971%2C1972%2C1973%2C1974%2C1975%2C1976%2C1977%2C1978%2C1979%2C1980%2C1981%2C1982%2C1983%2C1984%2C1985%2C1986%2C1987%2C1988%2C1989%2C1990%2C1991%2C1992%2C1993%2C1994%2C1995%2C1996%2C1997%2C1998%2C1999%2C2000%2C2001%2C2002%2C2003%2C2004%2C2005%2C2006%2C2007%2C2008%2C2009%2C2010%2C2011%2C2012%2C2013%2C2014%2C2015%2C2016%2C2017%2C2018&show_codes=true&show_unit=true&show_flags=true&null_values=false&output_type=csv'
+        api_call = self.api_url + 'GT?area=2%2C3%2C4%2C5%2C6%2C7%2C258%2C8%2C9%2C1%2C22%2C10%2C11%2C52%2C12%2C13%2C16%2C14%2C57%2C255%2C15%2C23%2C53%2C17%2C18%2C19%2C80%2C20%2C21%2C239%2C26%2C27%2C233%2C29%2C35%2C115%2C32%2C33%2C36%2C37%2C39%2C259%2C40%2C351%2C96%2C128%2C214%2C41%2C44%2C45%2C46%2C47%2C48%2C98%2C49%2C50%2C167%2C51%2C107%2C116%2C250%2C54%2C72%2C55%2C56%2C58%2C59%2C60%2C61%2C178%2C63%2C209%2C238%2C62%2C65%2C64%2C66%2C67%2C68%2C69%2C70%2C74%2C75%2C73%2C79%2C81%2C82%2C84%2C85%2C86%2C87%2C88%2C89%2C90%2C175%2C91%2C93%2C94%2C95%2C97%2C99%2C100%2C101%2C102%2C103%2C104%2C264%2C105%2C106%2C109%2C110%2C112%2C108%2C114%2C83%2C118%2C113%2C120%2C119%2C121%2C122%2C123%2C124%2C125%2C126%2C256%2C129%2C130%2C131%2C132%2C133%2C134%2C127%2C135%2C136%2C137%2C270%2C138%2C145%2C140%2C141%2C273%2C142%2C143%2C144%2C28%2C147%2C148%2C149%2C150%2C151%2C153%2C156%2C157%2C158%2C159%2C160%2C161%2C154%2C163%2C162%2C221%2C164%2C165%2C180%2C299%2C166%2C168%2C169%2C170%2C171%2C172%2C173%2C174%2C177%2C179%2C117%2C146%2C183%2C185%2C184%2C182%2C187%2C188%2C189%2C190%2C191%2C244%2C192%2C193%2C194%2C195%2C272%2C186%2C196%2C197%2C200%2C199%2C198%2C25%2C201%2C202%2C277%2C203%2C38%2C276%2C206%2C207%2C260%2C210%2C211%2C212%2C208%2C216%2C176%2C217%2C218%2C219%2C220%2C222%2C223%2C213%2C224%2C227%2C228%2C226%2C230%2C225%2C229%2C215%2C240%2C231%2C234%2C235%2C155%2C236%2C237%2C243%2C205%2C249%2C248%2C251%2C181&area_cs=FAO&element=7231&item=1711&year=1961%2C1962%2C1963%2C1964%2C1965%2C1966%2C1967%2C1968%2C1969%2C1970%2C1971%2C1972%2C1973%2C1974%2C1975%2C1976%2C1977%2C1978%2C1979%2C1980%2C1981%2C1982%2C1983%2C1984%2C1985%2C1986%2C1987%2C1988%2C1989%2C1990%2C1991%2C1992%2C1993%2C1994%2C1995%2C1996%2C1997%2C1998%2C1999%2C2000%2C2001%2C2002%2C2003%2C2004%2C2005%2C2006%2C2007%2C2008%2C2009%2C2010%2C2011%2C2012%2C2013%2C2014%2C2015%2C2016%2C2017%2C2018&show_codes=true&show_unit=true&show_flags=true&null_values=false&output_type=csv'
         
         csv_name = "FAO_Total_Agricultural_Emissions_in_CO2_equivalents.csv"
-        self.getFile(api_call, csv_name)
 
-        
+
         # Data filtering
-        FAO_CO2_df = pd.read_csv(csv_name)
+        FAO_CO2_df = self.readCsvFile(api_call, csv_name)
+        FAO_CO2_df = self.filterAreas(FAO_CO2_df, "Area Code (FAO)")
 
         # Rename indicator column
         FAO_CO2_df = FAO_CO2_df.rename(columns={'Item': 'Source'})
         FAO_CO2_df = FAO_CO2_df.rename(columns={'Element': 'Item'})
 
-        self.faoRenameAreaNames(FAO_CO2_df)
-
-        # Filter dataframe to only include target countries
-        FAO_CO2_df = FAO_CO2_df[FAO_CO2_df.Area.isin(countries)]
-
         # Append unit to indicator, hard coded because using FAO_CO2_df["Unit"] was giving me a type error for some reason
         FAO_CO2_df.Item = FAO_CO2_df.Item + " (" + FAO_CO2_df.Unit + ")"
 
         # Drop unnecessary columns
-        FAO_CO2_df = FAO_CO2_df.drop(columns=["Domain Code", "Domain", "Area Code (FAO)", "Element Code", "Item Code",
+        FAO_CO2_df = FAO_CO2_df.drop(columns=["Domain Code", "Domain", "Element Code", "Item Code",
                                              "Year Code", "Unit", "Flag", "Flag Description", "Note", "Source"])
 
         return FAO_CO2_df